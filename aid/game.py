@@ -37,7 +37,8 @@ class Session(object):
         self.user = user
         
         self.speech = Speech()
-        self.highscore = self.user.high_score(wordlist.name)
+        self.um = database.get_user_manager()
+        self.highscore = self.um.high_score(self.user, wordlist.name)
 
         self.score = 0
         self.attempts = {}
@@ -57,13 +58,9 @@ class Session(object):
         
     def end(self):
         '''Ends the spelling session.'''
-        # Add the score for the session to the user object.
-        self.user.add_score(self.wordlist.name, self.score)
-        
-        # Update the user record in the database.
-        um = database.get_user_manager()
-        um.update_user(self.user)
-        um.commit()
+        # Record the score for the session in the database.
+        self.um.add_score(self.user, self.wordlist.name, self.score)
+        self.um.commit()
         
         # Tell the interface the score the user achieved so that it can display
         # a score window.
@@ -3,6 +3,8 @@ Module to _build each view and manage behaviour of the Spellathon application.
 
 Exported classes:
 
+ListWatch -- Pass changes to the wordlists directory to a model.
+Debounce -- Call a function once its input has stopped changing.
 UserListModel -- Model to keep track of the users in the user management view.
 WordDestinationModel -- Model to keep track of the destination list in the list
 edit view.
@@ -14,12 +16,133 @@ column list widget in the list management view.
 
 '''
 from Tkinter import *
+import glob
 import shutil
 import os
 import tkMessageBox
 import tools.tldr as tldr
 import tools.config as config
+import tools.mapped as mapped
 import tools.database as db
+import tools.watcher as watcher
+from aid.words import SortedWords
+
+# Milliseconds between checks for lists being added, changed or removed.
+WATCH_INTERVAL = 1000
+
+# Milliseconds to wait after a filter was last typed in before applying it.
+FILTER_DELAY = 200
+
+# Shortest source filter looked up in the database's prefix index. Shorter
+# filters match so many words that the loaded words are quicker to search.
+SEARCH_MIN_LENGTH = 3
+
+class ListWatch(object):
+    '''Passes the changes to the wordlists directory to a handler while a
+    widget exists, checking for them from the Tk event loop.
+    
+    Public functions:
+    stop -- Stop watching the directory.
+    
+    '''
+    def __init__(self, widget, handler, path='wordlists/',
+                 interval=WATCH_INTERVAL):
+        '''Start watching the directory.
+        
+        Arguments:
+        widget -- The widget whose lifetime the watch lasts for.
+        handler -- Function called with the list of (event, name, path) tuples
+        returned by tools.watcher.ListWatcher.poll.
+        path -- The directory to watch.
+        interval -- Milliseconds between checks for changes.
+        
+        '''
+        self.widget = widget
+        self.handler = handler
+        self.interval = interval
+        self.watcher = watcher.ListWatcher(path)
+        
+        # Stop watching when the widget is destroyed, as the scheduled check
+        # would otherwise call back into a destroyed widget.
+        self.widget.bind('<Destroy>', self._on_destroy, add='+')
+        self.after = self.widget.after(self.interval, self._check)
+        
+    def stop(self):
+        '''Stop watching the directory.'''
+        if self.after:
+            self.widget.after_cancel(self.after)
+            self.after = None
+            
+        self.watcher.close()
+        
+    def _check(self):
+        '''Pass any changes to the handler and schedule the next check.'''
+        try:
+            events = self.watcher.poll()
+            
+            if events:
+                self.handler(events)
+        finally:
+            self.after = self.widget.after(self.interval, self._check)
+        
+    def _on_destroy(self, event):
+        if event.widget is self.widget:
+            self.stop()
+
+class Debounce(object):
+    '''Calls a function once a burst of requests for it has stopped, from the
+    Tk event loop, so that typing or pasting into a filter only filters once.
+    Each request cancels the call still waiting from the one before.
+    
+    Public functions:
+    schedule -- Call the function after the delay, instead of any call still
+    waiting.
+    cancel -- Cancel any call still waiting.
+    
+    '''
+    def __init__(self, widget, function, delay=FILTER_DELAY):
+        '''Create the debounce.
+        
+        Arguments:
+        widget -- The widget whose lifetime the calls last for.
+        function -- The function to call, with no arguments.
+        delay -- Milliseconds to wait after the last request. If 0, the
+        function is called straight away.
+        
+        '''
+        self.widget = widget
+        self.function = function
+        self.delay = delay
+        self.after = None
+        
+        # A call waiting when the widget is destroyed would call back into a
+        # destroyed widget.
+        self.widget.bind('<Destroy>', self._on_destroy, add='+')
+        
+    def schedule(self, *args):
+        '''Call the function after the delay, instead of any call still
+        waiting. Any arguments, such as those passed by a variable trace, are
+        ignored.'''
+        self.cancel()
+        
+        if self.delay > 0:
+            self.after = self.widget.after(self.delay, self._call)
+        else:
+            self.function()
+            
+    def cancel(self):
+        '''Cancel any call still waiting.'''
+        if self.after:
+            self.widget.after_cancel(self.after)
+            self.after = None
+            
+    def _call(self):
+        self.after = None
+        self.function()
+        
+    def _on_destroy(self, event):
+        if event.widget is self.widget:
+            self.cancel()
 
 class UserListModel(object):
     '''Model to keep track of the users in the user management view.
@@ -92,11 +215,12 @@ class WordDestinationModel(object):
     add_words -- Add a bunch of words to the list.
     _remove_word -- Remove the currently selected word from the list.
     _remove_all_words -- Remove all the words from the list.
-    save -- Write all the words in the list to disk, creating a new tldr file.
+    save -- Write the changes to the list to disk.
     filter_listbox -- Update the list to show words that match the filter.
     
     '''
-    def __init__(self, interface, listname, listbox, filter, filtervar):
+    def __init__(self, interface, listname, listbox, filter, filtervar,
+                 delay=FILTER_DELAY):
         '''Create the word destination model.
         
         Arguments:
@@ -105,6 +229,8 @@ class WordDestinationModel(object):
         listbox -- The listbox that shows the words currently in the list.
         filter -- The entry box where the filter is input.
         filtervar -- The string variable which keeps track of the filter input.
+        delay -- Milliseconds to wait after the filter last changed before
+        applying it (optional).
         
         '''
         self.interface = interface
@@ -115,11 +241,16 @@ class WordDestinationModel(object):
         
         self.listbox.add_listener(self)
         
-        # Get the words currently in the list by parsing the tldr.
-        self.wordlist = tldr.parse_tldr('wordlists/' + listname + '.tldr',
-                                        listname)
-        # Keep track of the filter.
-        self.filtervar.trace('w', self.filter_listbox)
+        # Get the words currently in the list by parsing the tldr, unless it
+        # is cached and hasn't changed since.
+        self.wordlist = tldr.load_tldr('wordlists/' + listname + '.tldr',
+                                       listname)
+        # The words changed since the list was read or saved, with None for
+        # those which were removed, so that small edits can be saved quickly.
+        self.changes = {}
+        # Keep track of the filter, applying it once typing pauses.
+        self.debounce = Debounce(self.filter, self.filter_listbox, delay)
+        self.filtervar.trace('w', self.debounce.schedule)
         
         self.listbox.items = self.wordlist.words
         self.listbox.update()
@@ -131,45 +262,59 @@ class WordDestinationModel(object):
     def _add_word(self, word):
         '''Add a word to the list.'''
         self.wordlist._add_word(word)
+        string = getattr(word, 'word', word)
+        self.changes[string] = self.wordlist.words[string]
         # Update the list of words according to the filter.
         self.filter_listbox()
         
     def add_words(self, words):
-        '''Add a bunch of words to the list.'''
-        self.wordlist.words = dict(words.items() + self.wordlist.words.items())
-        # Update the list of words according to the filter.
-        self.filter_listbox()
+        '''Add a bunch of words to the list. Words already in the list are
+        kept as they are.'''
+        added = self.wordlist.merge(words, replace=False).added
+        self.changes.update(added)
+        
+        # Only the added words need to be shown, if they match the filter.
+        query = self.filtervar.get().lower()
+        
+        for key, value in added.iteritems():
+            if key.lower().startswith(query):
+                self.listbox.items[key] = value
+                
+        self.listbox.update()
             
     def _remove_word(self, word):
         '''Remove a word from the list.'''
         self.wordlist.del_word(word)
+        self.changes[getattr(word, 'word', word)] = None
         self.listbox.delete(word)
         self.interface.reset_metadata()
         
     def _remove_all_words(self):
         '''Remove all words from the list.'''
         # Only remove those words which are currently visible in the list.
-        for word in self.listbox.items.keys():
-            self.wordlist.del_word(word)
-            
-        self.listbox.items = self.wordlist.words
-        self.filter_listbox()
+        self.changes.update(self.wordlist.difference(self.listbox.items).log())
+        
+        # Every visible word was removed, so none are left to show.
+        self.listbox.items = SortedWords()
+        self.listbox.update()
         self.interface.reset_metadata()
         
     def save(self):
-        '''Write all the words in the list to disk, creating a new tldr file.'''
-        tldr.generate_tldr(self.wordlist, 'wordlists/' + self.wordlist.name + 
-                           '.tldr')
+        '''Write the changes to the list to disk. Small changes are added to
+        the list's change log, while larger ones rewrite the tldr file.'''
+        if tldr.save_tldr(self.wordlist, 'wordlists/' + self.wordlist.name +
+                          '.tldr', self.changes):
+            self.changes = {}
     
     def filter_listbox(self, *args):
-        '''Update the listbox to show only words which match the user's
+        '''Update the listbox to show only words which start with the user's
         filter.'''
-        self.listbox.items = {}
-        
-        for key, value in self.wordlist.words.iteritems():
-            if not key.lower().find(self.filtervar.get().lower()):
-                self.listbox.items[key] = value                
+        # The filter is applied now, so any waiting call would only repeat it.
+        self.debounce.cancel()
         
+        # The list's words are kept sorted ignoring case, so the matches are
+        # found by a binary search rather than by checking every word.
+        self.listbox.items = self.wordlist.words.with_prefix(self.filtervar.get())
         self.listbox.update()
         
 class WordSourceModel(object):
@@ -186,7 +331,8 @@ class WordSourceModel(object):
     get_words -- Get all of the words currently in the source list.
     
     '''
-    def __init__(self, interface, optionmenu, optionmenuvar, listbox, filter, filtervar):
+    def __init__(self, interface, optionmenu, optionmenuvar, listbox, filter, filtervar,
+                 delay=FILTER_DELAY):
         '''Create the word source model.
         
         Arguments:
@@ -198,6 +344,8 @@ class WordSourceModel(object):
         filter -- Entry box where the user enters the filter.
         filtervar -- StringVar which keeps track of what is entered in the
         filter. 
+        delay -- Milliseconds to wait after the filter last changed before
+        applying it (optional).
         
         '''
         self.interface = interface
@@ -206,11 +354,16 @@ class WordSourceModel(object):
         self.listbox = listbox
         self.filter = filter
         self.filtervar = filtervar
-        self.items = {}
+        self.items = SortedWords()
+        # The sources whose words have been added to the items.
+        self.sources = set()
         self.word = None
         
         self.optionmenuvar.trace('w', self.source_chosen)
-        self.filtervar.trace('w', self.filter_listbox)
+        # Apply the filter once typing pauses, as searching the database on
+        # every key press makes typing lag on large sources.
+        self.debounce = Debounce(self.filter, self.filter_listbox, delay)
+        self.filtervar.trace('w', self.debounce.schedule)
         self.wm = db.get_word_manager()
         
         self.listbox.add_listener(self)
@@ -221,22 +374,39 @@ class WordSourceModel(object):
         # Retrieve the words from the database.
         words = self.wm.retrieve_words_of_difficulty(self.optionmenuvar.get())
         
-        for word in words:
-            self.items[word.word] = word
+        self.items.update((word.word, word) for word in words)
+        self.sources.add(self.optionmenuvar.get())
         
         # Add all the words to the listbox and update the display.
         self.listbox.items = self.items
         self.listbox.update()
         
     def filter_listbox(self, *args):
-        '''Update the listbox to show only words which match the user's
-        filter.'''
-        self.listbox.items = {}
-        
-        for key, value in self.items.iteritems():
-            if not key.lower().find(self.filtervar.get().lower()):
-                self.listbox.items[key] = value                
+        '''Update the listbox to show only the words of the chosen sources
+        which start with the user's filter, ignoring case. Every match is
+        shown, as adding all or a number of random words acts on the words
+        shown.'''
+        self.debounce.cancel()
+        query = self.filtervar.get()
+        
+        if not query.strip():
+            # The source listbox never changes its items, so they can be
+            # shared rather than copied, as they are in source_chosen.
+            items = self.items
+        elif (len(query.strip()) >= SEARCH_MIN_LENGTH and
+              self.wm._has_search_index()):
+            # Look the words up in the prefix index of the word column, which
+            # only reads the matching words of the sources.
+            items = SortedWords()
+            items.update((word.word, word) for word in
+                         self.wm.words_with_prefix(query, list(self.sources)))
+        else:
+            # Otherwise the loaded words which start with the filter are found
+            # by a binary search of the sorted words. Without the full text
+            # index the database would have to scan every word.
+            items = self.items.with_prefix(query)
         
+        self.listbox.items = items
         self.listbox.update()
         
     def listbox_select(self, string, word):
@@ -258,6 +428,7 @@ class TLDROptionMenuModel(object):
 
     Public functions:
     update_entries -- Add an entry to the option menu for each tldr file.
+    update_lists -- Apply changes to the tldr files to the option menu.
     get_list_name -- Return the name of the currently selected list.
     get_list -- Return the WordList object of the currently selected list.
     
@@ -272,32 +443,67 @@ class TLDROptionMenuModel(object):
         '''
         self.optionmenu = optionmenu
         self.optionmenuvar = optionmenuvar
-        # Get all of the wordlists in the wordlists folder.
-        self.wordlists = tldr.parse_tldr_files('wordlists/')
+        # Watch for lists changing from before they are read, so that no
+        # change is missed.
+        self.watch = ListWatch(self.optionmenu, self.update_lists)
+        # Find all of the wordlists in the wordlists folder. They are only
+        # opened when they are used.
+        self.wordlists = dict((tldr.list_name(path), path)
+                              for path in glob.glob('wordlists/*.tldr'))
         
         # Populate the option menu.
         self.update_entries()
     
     def update_entries(self):
-        '''Add an entry to the option menu for each tldr file.'''
+        '''Add an entry to the option menu for each tldr file. The selected
+        list stays selected if it still exists.'''
         self.optionmenu['menu'].delete(0, END)
         
         if self.wordlists:
             for i in sorted(self.wordlists.keys()):
                 self.optionmenu['menu'].add_command(label=i, command=lambda temp = i: self.optionmenu.setvar(self.optionmenu.cget('textvariable'), value = temp))
             
-            self.optionmenuvar.set(sorted(self.wordlists.keys())[0])
+            if self.optionmenuvar.get() in self.wordlists:
+                # Setting the list again lets anything tracing the variable
+                # know that the list may have changed.
+                self.optionmenuvar.set(self.optionmenuvar.get())
+            else:
+                self.optionmenuvar.set(sorted(self.wordlists.keys())[0])
         else:
             self.optionmenuvar.set("")
+            
+    def update_lists(self, events):
+        '''Apply changes to the tldr files to the option menu.
+        
+        Arguments:
+        events -- A list of (event, name, path) tuples as returned by
+        tools.watcher.ListWatcher.poll.
+        
+        '''
+        for event, name, path in events:
+            if event == watcher.REMOVED:
+                self.wordlists.pop(name, None)
+            else:
+                self.wordlists[name] = path
+        
+        self.update_entries()
         
     def get_list_name(self):
         '''Return the name of the currently selected list.'''
         return self.optionmenuvar.get()
     
     def get_list(self):
-        '''Return the WordList object of the currently selected list.'''
-        if self.optionmenuvar.get() != "":
-            return self.wordlists[self.optionmenuvar.get()]
+        '''Return the WordList object of the currently selected list. The
+        words are read from the file as they are looked up, so the list can't
+        be changed.'''
+        name = self.optionmenuvar.get()
+        
+        if name != "":
+            try:
+                return mapped.open_tldr(self.wordlists[name], name)
+            except (IOError, OSError):
+                # The list was removed since the menu was last updated.
+                return None
         else:
             return None
         
@@ -306,8 +512,12 @@ class TLDRMultiScrollListbox(object):
     column list widget in the list management view.
     
     Public functions:
-    update_items -- Parse each tldr file and display an entry for it.
+    update_items -- Read the header of each tldr file and display an entry for
+    it.
+    update_lists -- Apply changes to the tldr files to the listbox.
     import_list -- Import a tldr file from outside the application.
+    store_lists -- Save every tldr file to the database.
+    export_list -- Write the selected list in the database to a tldr file.
     delete -- Delete a tldr file.
     
     '''
@@ -320,38 +530,71 @@ class TLDRMultiScrollListbox(object):
         
         '''
         self.listbox = listbox
-        self.wordlists = tldr.parse_tldr_files('wordlists/')
+        # Watch for lists changing from before they are read, so that no
+        # change is missed.
+        self.watch = ListWatch(self.listbox, self.update_lists)
+        self.wordlists = tldr.scan_tldr_headers('wordlists/')
         
         # Populate the listbox.
         self.update_items()
         
     def update_items(self):
-        '''Parse each tldr file and display an entry for it.'''
-        wordlists = tldr.parse_tldr_files('wordlists/')
+        '''Read the header of each tldr file and display an entry for it.'''
+        # Only the headers are needed for the name, source, date and number of
+        # words, so the words themselves aren't parsed.
+        wordlists = tldr.scan_tldr_headers('wordlists/')
         
         # Keep track of which list was added.
         new_wordlist_names = [wordlist for wordlist in wordlists.iterkeys() if 
                               wordlist not in self.wordlists.iterkeys()]
         
-        items = []
         self.wordlists = wordlists
+        self._display()
+        
+        # Return the names of the added lists.
+        return new_wordlist_names
+    
+    def update_lists(self, events):
+        '''Apply changes to the tldr files to the listbox. Only the headers of
+        the lists which were added or changed are read.
+        
+        Arguments:
+        events -- A list of (event, name, path) tuples as returned by
+        tools.watcher.ListWatcher.poll.
+        
+        '''
+        for event, name, path in events:
+            if event == watcher.REMOVED:
+                self.wordlists.pop(name, None)
+            else:
+                try:
+                    self.wordlists[name] = tldr.scan_tldr_header(path)
+                except IOError:
+                    # The list was removed again before it could be read.
+                    self.wordlists.pop(name, None)
+                    
+        self._display()
+        
+    def _display(self):
+        '''Display an entry for each list.'''
+        items = []
         
         # Build the list of tuples to pass to the multi column listbox widget.
-        for wordlist in self.wordlists.values():
-            items.append((wordlist.name, wordlist.source, wordlist.date_edited,
-                          str(len(wordlist.words))))
+        for name, header in self.wordlists.iteritems():
+            items.append((name, header['source'], header['date_edited'],
+                          str(header['count'])))
             
         self.listbox.items = sorted(items)
         self.listbox.update()
         
-        # Return the names of the added lists.
-        return new_wordlist_names
-        
     def import_list(self, listfile):
         '''Import a tldr file from outside the application.'''
         try:
             # Move the list to the spellingaid directory
             shutil.copy(listfile, 'wordlists/')
+            # Keep a copy of the list in the database, from which it can be
+            # exported again.
+            tldr.import_tldr(listfile, tldr.list_name(listfile))
             # Add the list
             self.update_items()
         except IOError:
@@ -360,8 +603,34 @@ class TLDRMultiScrollListbox(object):
         except Exception:
             tkMessageBox.showerror('Error', 'Either no file was selected or that list already exists.')
         
+    def store_lists(self):
+        '''Save every tldr file to the database, replacing the lists of the
+        same names there.'''
+        try:
+            names = tldr.import_tldr_files('wordlists/')
+        except (IOError, db.sqlite.Error):
+            tkMessageBox.showerror('Error', 'The lists could not be saved to the database.')
+        else:
+            tkMessageBox.showinfo('Lists saved', str(len(names)) + ' lists were saved to the database.')
+            
+    def export_list(self, listfile):
+        '''Write the selected list, as it is kept in the database, to a tldr
+        file.
+        
+        Arguments:
+        listfile -- The file to write the list to.
+        
+        '''
+        name = self.listbox.get()
+        
+        if not name:
+            tkMessageBox.showerror('Error', 'No list selected.')
+        elif not tldr.export_tldr(name, listfile):
+            tkMessageBox.showerror('Error', 'That list has not been saved to the database, or the file could not be written.')
+            
     def delete(self):
-        '''Delete a tldr file.'''
+        '''Delete a tldr file, and the list of the same name in the
+        database.'''
         tldr = self.listbox.get()
         
         if tldr:
@@ -371,6 +640,19 @@ class TLDRMultiScrollListbox(object):
             except IOError:
                 os.mkdir('trash')
                 shutil.copy('wordlists/' + tldr + '.tldr', 'trash/' + tldr + '.tldr')
+            
+            # Keep any unmerged changes to the list with it.
+            if os.path.exists('wordlists/' + tldr + '.tldr.log'):
+                shutil.move('wordlists/' + tldr + '.tldr.log',
+                            'trash/' + tldr + '.tldr.log')
+            
+            # The index can be built again from the list if it is restored.
+            if os.path.exists('wordlists/' + tldr + '.tldr.idx'):
+                os.remove('wordlists/' + tldr + '.tldr.idx')
+            
+            lm = db.get_list_manager()
+            lm.remove_list(tldr)
+            lm.commit()
         else:
             tkMessageBox.showerror('Error', 'No list selected.')
         
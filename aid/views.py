@@ -746,17 +746,15 @@ class Score(Dialog):
             
             self.list_difficulty_lbl.config(text=str(difficulty))
             
-            try:
-                # Get the number of attempts the user has made at this list.
-                attempts = len(self.user._scores[wordlist.name])
-            except KeyError:
-                # If they haven't made any attempts then:
-                attempts = 0
+            um = database.get_user_manager()
+            
+            # Get the number of attempts the user has made at this list.
+            attempts = um.attempts(self.user, wordlist.name)
                 
             self.list_num_attempts_lbl.config(text=str(attempts))
             
             # Get the user high score.
-            highscore = self.user.high_score(wordlist.name)
+            highscore = um.high_score(self.user, wordlist.name)
             self.list_high_score_lbl.config(text=str(highscore))
         else:
             pass
@@ -804,6 +802,8 @@ class ListManagement(Frame):
     delete_list -- Move a list to the trash.
     list_edit -- Open the list edit dialog.
     import_list -- Import a tldr from an outside source.
+    store_lists -- Save every list to the database.
+    export_list -- Write a list from the database to a tldr file.
 
     '''
     def __init__(self, master=None):
@@ -831,15 +831,18 @@ class ListManagement(Frame):
         self.delete_list_btn = Button(self.manage_lists_frame, text='Delete list', command=self.delete_list)
         self.edit_list_btn = Button(self.manage_lists_frame, text='Edit list', command=self.list_edit)
         self.import_list_btn = Button(self.manage_lists_frame, text='Import list', command=self.import_list)
+        self.store_lists_btn = Button(self.manage_lists_frame, text='Save lists to database', command=self.store_lists)
+        self.export_list_btn = Button(self.manage_lists_frame, text='Export list', command=self.export_list)
         
         self.controls = [self.new_list_btn, self.delete_list_btn,
-                         self.edit_list_btn, self.import_list_btn]
+                         self.edit_list_btn, self.import_list_btn,
+                         self.store_lists_btn, self.export_list_btn]
 
     def _arrange(self):
         '''Arrange the widgets.'''
         self.manage_lists_frame.grid(**pad5)
         
-        self.list_lbx.grid(column=0, row=0, rowspan=4, **pad5)
+        self.list_lbx.grid(column=0, row=0, rowspan=len(self.controls), **pad5)
         
         for i, control in enumerate(self.controls):
             control.grid(column=1, row=i, sticky='we', padx=5, pady=2)
@@ -847,12 +850,13 @@ class ListManagement(Frame):
     def new_list(self):
         '''Open the new list dialog.'''
         nl = NewList(master=self, title='New list', btncolumn=0)
-        new_lists = self.list_model.update_items()
+        self.list_model.update_items()
         
         # If a list was created, open the list edit window to let the user
-        # add words.
-        if new_lists:         
-            self.list_edit(new_lists[0])
+        # add words. The list watcher may already have added it to the
+        # model while the dialog was open, so the dialog reports its name.
+        if nl.result:
+            self.list_edit(nl.result)
             
     def delete_list(self):
         '''Delete a list.'''
@@ -878,6 +882,18 @@ class ListManagement(Frame):
         listfile = tkFileDialog.askopenfilename(filetypes=[('tldr files', '.tldr')])
         if listfile != '':
             self.list_model.import_list(listfile)
+            
+    def store_lists(self):
+        '''Save every list to the database.'''
+        self.list_model.store_lists()
+        
+    def export_list(self):
+        '''Open a file dialog to choose where to export a list from the
+        database to.'''
+        listfile = tkFileDialog.asksaveasfilename(defaultextension='.tldr',
+                                                  filetypes=[('tldr files', '.tldr')])
+        if listfile != '':
+            self.list_model.export_list(listfile)
 
 class NewList(Dialog):
     '''Dialog where new list information is given by the user.'''
@@ -927,6 +943,7 @@ class NewList(Dialog):
         path = 'wordlists/' + name + '.tldr'
         
         tldr.generate_empty_tldr(path, name, author)
+        self.result = name
         
 class ListEdit(Dialog):
     '''Add and remove words from lists.
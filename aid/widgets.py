@@ -13,6 +13,7 @@ Dialog -- A toplevel window for taking user input and validating it.
 from Tkinter import *
 import datetime
 import tkMessageBox
+from aid.words import SortedWords
 
 class DateEntry(Frame):
     '''A group of combo boxes for taking day/month/year input.
@@ -398,9 +399,14 @@ class ScrollListbox(Frame):
         self.update()
                     
     def update(self):
-        '''Update the entries in the listbox.'''
+        '''Update the entries in the listbox, sorted ignoring case.'''
         self.listbox.delete(first=0, last=END)
-        self.listbox.insert(END, *sorted(self.items.keys()))
+        
+        # A SortedWords is kept in order, so only other mappings are sorted.
+        if isinstance(self.items, SortedWords):
+            self.listbox.insert(END, *self.items.keys())
+        else:
+            self.listbox.insert(END, *sorted(self.items.keys(), key=str.lower))
         
     def add_listener(self, listener):
         '''Add a listener to be notified of listbox selection events.
@@ -5,12 +5,98 @@ Exported classes:
 
 Word -- Represents a word with a related definition, example use, and difficulty
 level.
+WordTable -- A compact mapping of words to Word objects.
+SortedWords -- A mapping of words to Word objects kept in display order.
+ChangeSet -- The words added to, removed from and updated in a WordList.
 WordList -- Manages lists of words.
 
+Exported functions:
+
+join_fields -- Join the fields of a word into a line of the tldr format.
+split_fields -- Split a line of the tldr format into the fields of a word.
+
 '''
+from collections import MutableMapping
+from itertools import chain
+import re
+
+# Every difficulty level seen so far, so that each Word shares a single copy
+# of its difficulty string rather than holding its own.
+difficulties = {}
+
+# A field separator, or a character escaped with a backslash.
+_SEPARATOR = re.compile(r'\\([\\|])|\|')
+
+def _escape(field):
+    '''Escape the backslashes and field separators in a field.'''
+    if not isinstance(field, basestring):
+        field = str(field)
+    
+    if '\\' in field or '|' in field:
+        field = field.replace('\\', '\\\\').replace('|', '\\|')
+    
+    return field
+
+def join_fields(fields):
+    '''Join the fields of a word with '|', the separator of the tldr format.
+    Any '|' or backslash within a field is escaped with a backslash, so a
+    field can hold a '|' without being split in two when it is read.'''
+    try:
+        line = '|'.join(fields)
+    except TypeError:
+        # A field which isn't a string, such as a numeric difficulty.
+        line = None
+    
+    # Almost no fields need escaping, so they are only escaped one at a time
+    # if the plain join shows that some do.
+    if (line is None or '\\' in line or
+        line.count('|') != len(fields) - 1):
+        line = '|'.join([_escape(field) for field in fields])
+    
+    return line
+
+def split_fields(line):
+    '''Split a line joined by join_fields back into its fields. A backslash
+    which doesn't escape a '|' or another backslash is kept as it is, so lines
+    written before fields were escaped read the same as they always did.'''
+    if '\\' not in line:
+        return line.split('|')
+    
+    fields = []
+    parts = []
+    start = 0
+    
+    for match in _SEPARATOR.finditer(line):
+        parts.append(line[start:match.start()])
+        
+        if match.group(1):
+            parts.append(match.group(1))
+        else:
+            fields.append(''.join(parts))
+            parts = []
+            
+        start = match.end()
+        
+    parts.append(line[start:])
+    fields.append(''.join(parts))
+    return fields
+
+def _intern_difficulty(difficulty):
+    '''Return the shared copy of a difficulty level, without any surrounding
+    whitespace (such as the end of the line it was read from).'''
+    try:
+        difficulty = difficulty.strip()
+    except AttributeError:
+        pass
+    
+    return difficulties.setdefault(difficulty, difficulty)
+
 class Word(object):
     '''Represents a word with a related definition, example use, and difficulty
     level.'''
+    # Words are created in large numbers, so they don't carry a __dict__.
+    __slots__ = ('word', 'definition', 'example', 'difficulty')
+    
     def __init__(self, word, definition='no definition', example='no example', difficulty='none'):
         '''Create a word with a definition, example use, and difficulty level.
         
@@ -24,21 +110,227 @@ class Word(object):
         self.word = word
         self.definition = definition
         self.example = example
-        self.difficulty = difficulty
+        self.difficulty = _intern_difficulty(difficulty)
         
     def serialise(self):
         '''Return a string which represents a word in the tldr format.'''
-        return ('{word}|{definition}|{example}|{difficulty}'.format(**self.__dict__)).encode('utf-8')
+        return join_fields([self.word, self.definition, self.example,
+                            self.difficulty]).encode('utf-8')
                 
     @classmethod
     def deserialise(cls, line):
         '''Take a string in tldr format and create a Word representation.'''
-        return cls(*line.split('|'))
+        return cls(*split_fields(line.rstrip('\r\n')))
             
     def __str__(self):
         '''Return the word itself as the string representation.'''
         return self.word
     
+class WordTable(MutableMapping):
+    '''A mapping of words to Word objects which stores the definition, example
+    and difficulty of each word as a single string, and only builds a Word
+    when one is looked up. It takes a fraction of the memory of a dict of
+    Words, so it suits lists which are kept around but rarely read, such as
+    those in the tldr cache. Words looked up are new objects each time, so
+    changing one doesn't change the table; store it again instead.
+    
+    Public functions:
+    copy -- Return a copy of the table.
+    
+    '''
+    def __init__(self, words=None):
+        '''Create the table.
+        
+        Arguments:
+        words -- A mapping or iterable of (word, Word) pairs to fill the table
+        with (optional).
+        
+        '''
+        self.rows = {}
+        
+        if words:
+            self.update(words)
+            
+    def __getitem__(self, word):
+        definition, example, difficulty = split_fields(self.rows[word])
+        return Word(word, definition, example, difficulty)
+    
+    def __setitem__(self, word, value):
+        # The fields are joined in the same way as a line of the tldr format.
+        self.rows[word] = join_fields([value.definition, value.example,
+                                       value.difficulty])
+        
+    def __delitem__(self, word):
+        del self.rows[word]
+        
+    def __contains__(self, word):
+        return word in self.rows
+        
+    def __iter__(self):
+        return iter(self.rows)
+    
+    def __len__(self):
+        return len(self.rows)
+    
+    def keys(self):
+        return self.rows.keys()
+    
+    def copy(self):
+        '''Return a copy of the table. The rows are strings, so they are
+        shared rather than copied.'''
+        table = WordTable()
+        table.rows = self.rows.copy()
+        return table
+    
+class SortedWords(MutableMapping):
+    '''A mapping of words to Word objects which keeps its words in display
+    order, that is sorted ignoring case, as they are added and removed, so
+    that they can be listed or saved without being sorted again. Words with
+    the same case folded spelling are sorted by their spelling as is.
+    
+    Each word added or removed is found with a binary search, and adding the
+    words in order (such as when reading a tldr file) only appends them. The
+    order only holds the words themselves, which are shared with the keys of
+    the mapping, and each word is case folded as it is compared.
+    
+    Public functions:
+    with_prefix -- Return the words which start with a prefix.
+    copy -- Return a copy of the mapping.
+    
+    '''
+    def __init__(self, words=None):
+        '''Create the mapping.
+        
+        Arguments:
+        words -- A mapping or iterable of (word, Word) pairs to fill the
+        mapping with (optional).
+        
+        '''
+        self.words = {}
+        # The words, sorted by _sort_key.
+        self.order = []
+        
+        if words:
+            self.update(words)
+            
+    def __getitem__(self, word):
+        return self.words[word]
+    
+    def __setitem__(self, word, value):
+        if word not in self.words:
+            key = _sort_key(word)
+            
+            if not self.order or _sort_key(self.order[-1]) < key:
+                self.order.append(word)
+            else:
+                self.order.insert(_bisect(self.order, key), word)
+                
+        self.words[word] = value
+        
+    def __delitem__(self, word):
+        del self.words[word]
+        del self.order[_bisect(self.order, _sort_key(word))]
+        
+    def __contains__(self, word):
+        return word in self.words
+        
+    def __iter__(self):
+        return iter(self.order)
+            
+    def __len__(self):
+        return len(self.words)
+    
+    def keys(self):
+        return list(self.order)
+    
+    def update(self, words=(), **kwargs):
+        '''Add many words at once. The new words are put in order together
+        with a single sort, which is far quicker than inserting each one into
+        the middle of the order.'''
+        pairs = words
+        
+        if hasattr(words, 'keys'):
+            pairs = ((key, words[key]) for key in words.keys())
+            
+        for word, value in chain(pairs, kwargs.iteritems()):
+            if word not in self.words:
+                self.order.append(word)
+                
+            self.words[word] = value
+            
+        # The order is made of sorted runs, which sort() merges in linear time.
+        self.order.sort(key=_sort_key)
+    
+    def with_prefix(self, prefix):
+        '''Return a SortedWords of the words which start with a prefix,
+        ignoring case. The first match is found with a binary search, so only
+        the matching words are looked at.'''
+        prefix = prefix.lower()
+        order = self.order
+        words = SortedWords()
+        i = _bisect(order, (prefix,))
+        
+        while i < len(order) and order[i].lower().startswith(prefix):
+            words.words[order[i]] = self.words[order[i]]
+            words.order.append(order[i])
+            i += 1
+            
+        return words
+    
+    def copy(self):
+        '''Return a copy of the mapping. The Word objects are shared.'''
+        words = SortedWords()
+        words.words = self.words.copy()
+        words.order = list(self.order)
+        return words
+    
+def _sort_key(word):
+    '''Return the key SortedWords orders a word by: the word case folded, and
+    then as it is.'''
+    return (word.lower(), word)
+
+def _bisect(order, key):
+    '''Return the index in a list of words sorted by _sort_key at which a word
+    with the given key would be inserted, before any word with an equal key.
+    The same as bisect.bisect_left, but comparing the key of each word.'''
+    low, high = 0, len(order)
+    
+    while low < high:
+        middle = (low + high) // 2
+        
+        if _sort_key(order[middle]) < key:
+            low = middle + 1
+        else:
+            high = middle
+            
+    return low
+    
+class ChangeSet(object):
+    '''The words added to, removed from and updated in a WordList by a single
+    operation. Each of added, removed and updated is a mapping of words to
+    Word objects, holding the new Word for those added or updated and the old
+    one for those removed.
+    
+    Public functions:
+    log -- Return the changes in the form tools.tldr.save_tldr takes.
+    
+    '''
+    def __init__(self):
+        self.added = {}
+        self.removed = {}
+        self.updated = {}
+        
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.updated)
+    
+    def log(self):
+        '''Return a dictionary of each changed word to its new Word, or None
+        if it was removed.'''
+        log = dict.fromkeys(self.removed)
+        log.update(self.added)
+        log.update(self.updated)
+        return log
+    
 class WordList(object):
     '''Manages lists of words.
 
@@ -46,6 +338,9 @@ class WordList(object):
     _add_word -- Adds a word to the list of words.
     del_word -- Deletes a word from the list of words.
     get_word -- Gets a word from the list of words.
+    merge -- Adds a bunch of words to the list of words.
+    difference -- Deletes a bunch of words from the list of words.
+    intersection -- Deletes every word not in a bunch of words.
 
     '''
     def __init__(self, name, source='', date_edited='', words=None):
@@ -55,17 +350,18 @@ class WordList(object):
         name -- The name of the listname of words
         source -- The author/source (optional)
         date_edited -- The date the word listname was last edited (optional)
-        words -- A dictionary object containing Word objects (optional)
+        words -- A dictionary, WordTable or SortedWords containing Word objects
+        (optional). By default the words are kept in a SortedWords.
         
         '''
         self.name = name
         self.source = source
         self.date_edited = date_edited
         
-        if words:
+        if words is not None:
             self.words = words
         else:
-            self.words = {}
+            self.words = SortedWords()
         
     def _add_word(self, word):
         '''Add a word to the list of words.
@@ -113,4 +409,85 @@ class WordList(object):
         except AttributeError:
             return self.words[word]
         except KeyError:
-            return ''
\ No newline at end of file
+            return ''
+        
+    def merge(self, words, replace=True):
+        '''Add a bunch of words to the list of words, in place.
+        
+        Arguments:
+        words -- A WordList or a dictionary of words to Word objects.
+        replace -- If False, words already in the list are kept as they are
+        rather than being replaced (optional).
+        
+        Returns:
+        A ChangeSet of the words added and updated.
+        
+        '''
+        if isinstance(words, WordList):
+            words = words.words
+            
+        changes = ChangeSet()
+        
+        for key, value in words.iteritems():
+            if key not in self.words:
+                self.words[key] = value
+                changes.added[key] = value
+            elif replace:
+                # Only count the words which are actually different.
+                if self.words[key].serialise() != value.serialise():
+                    self.words[key] = value
+                    changes.updated[key] = value
+                    
+        return changes
+    
+    def difference(self, words):
+        '''Delete a bunch of words from the list of words, in place.
+        
+        Arguments:
+        words -- A WordList, or a dictionary or other iterable of words.
+        
+        Returns:
+        A ChangeSet of the words removed.
+        
+        '''
+        if isinstance(words, WordList):
+            words = words.words
+            
+        changes = ChangeSet()
+        
+        if words is self.words:
+            # Removing every word, so hand the old words over whole.
+            changes.removed = self.words
+            self.words = type(self.words)()
+            return changes
+        
+        for key in words:
+            try:
+                changes.removed[key] = self.words.pop(key)
+            except KeyError:
+                pass
+            
+        return changes
+    
+    def intersection(self, words):
+        '''Delete every word which isn't in a bunch of words from the list of
+        words, in place.
+        
+        Arguments:
+        words -- A WordList, or a dictionary or set of words.
+        
+        Returns:
+        A ChangeSet of the words removed.
+        
+        '''
+        if isinstance(words, WordList):
+            words = words.words
+            
+        changes = ChangeSet()
+        
+        # The words to remove are found first, as the list can't be changed
+        # while it is being iterated over.
+        for key in [key for key in self.words if key not in words]:
+            changes.removed[key] = self.words.pop(key)
+            
+        return changes
\ No newline at end of file
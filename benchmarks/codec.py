@@ -0,0 +1,87 @@
+'''
+Benchmark reading a word list from a record in the binary format of
+tools/codec.py, as the tldr cache does from its snapshot, against parsing the
+same list from a tldr file.
+
+Both sides read the same words from a file and build the same structure, first
+the WordTable the cache keeps and then a dict of Words. Run from the Spellathon
+directory with:
+
+python -m benchmarks.codec [words]
+
+'''
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+import tools.codec as codec
+import tools.tldr as tldr
+from aid.words import Word, WordList
+
+def _make_list(words):
+    '''Return a WordList holding a number of words.'''
+    wordlist = WordList('benchmark', 'benchmark')
+
+    for i in range(words):
+        wordlist._add_word(Word('word%d' % i, 'The definition of word %d' % i,
+                                'An example using word %d' % i, 'CL%d' % (i % 9)))
+
+    return wordlist
+
+def _read(path):
+    '''Return the contents of a file.'''
+    with open(path, 'rb') as f:
+        return f.read()
+
+def _parse_dict(tldrfile):
+    '''Parse a tldr file into a dict of Words.'''
+    words = tldr.iter_tldr(tldrfile)
+    next(words)
+    return dict((word.word, word) for word in words)
+
+def _time(function):
+    '''Return the best time in milliseconds taken by a function.'''
+    return min(timeit.repeat(function, number=1, repeat=5)) * 1e3
+
+def _report(name, old, new):
+    '''Print the timings of the tldr and binary formats.'''
+    print '%-16s %10.2fms %10.2fms %6.1fx' % (name, old, new, old / new)
+
+def main():
+    words = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    path = tempfile.mkdtemp()
+
+    try:
+        tldrfile = os.path.join(path, 'benchmark.tldr')
+        recordfile = os.path.join(path, 'benchmark.rec')
+        tldr.generate_tldr(_make_list(words), tldrfile)
+
+        with open(recordfile, 'wb') as f:
+            f.write(codec.encode_wordlist(tldr.parse_tldr(tldrfile, 'benchmark')))
+
+        # Check that both sides really do build the same words.
+        parsed = tldr.parse_tldr(tldrfile, 'benchmark', compact=True)
+        decoded = codec.decode_wordlist(_read(recordfile), compact=True)[0]
+        assert parsed.words.rows == decoded.words.rows
+
+        parsed = _parse_dict(tldrfile)
+        decoded = codec.decode_wordlist(_read(recordfile))[0].words
+        assert sorted(parsed) == sorted(decoded)
+        assert all(parsed[w].serialise() == decoded[w].serialise() for w in parsed)
+
+        print '%d words' % words
+        print '%-16s %12s %12s %7s' % ('', 'tldr', 'binary', 'speedup')
+
+        _report('WordTable',
+                _time(lambda: tldr.parse_tldr(tldrfile, 'benchmark', compact=True)),
+                _time(lambda: codec.decode_wordlist(_read(recordfile), compact=True)))
+
+        _report('dict of Words',
+                _time(lambda: _parse_dict(tldrfile)),
+                _time(lambda: codec.decode_wordlist(_read(recordfile))))
+    finally:
+        shutil.rmtree(path)
+
+if __name__ == '__main__':
+    main()
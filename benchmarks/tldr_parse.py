@@ -0,0 +1,72 @@
+'''
+Benchmark parsing a directory of tldr files in one process against parsing it
+with a pool of worker processes.
+
+A synthetic corpus is written to a temporary directory, and each run starts
+with an empty parse cache so that every file is parsed. Run from the Spellathon
+directory with:
+
+python -m benchmarks.tldr_parse [files] [words per file] [workers]
+
+'''
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tools.tldr as tldr
+from aid.words import Word, WordList
+
+def _make_corpus(path, files, words):
+    '''Write a number of tldr files, each holding a number of words.'''
+    for i in range(files):
+        wordlist = WordList('list%d' % i, 'benchmark')
+
+        for j in range(words):
+            wordlist._add_word(Word('word%d_%d' % (i, j),
+                                    'The definition of word %d' % j,
+                                    'An example using word %d' % j, 'CL%d' % (j % 9)))
+
+        tldr.generate_tldr(wordlist, os.path.join(path, 'list%d.tldr' % i))
+
+def _time(path, workers):
+    '''Return the best time taken to parse every file in a directory.'''
+    best = None
+
+    for run in range(3):
+        tldr.cache = tldr.TLDRCache()
+        start = time.time()
+        wordlists = tldr.parse_tldr_files(path, workers)
+        seconds = time.time() - start
+
+        if best is None or seconds < best:
+            best = seconds
+
+    return best, sum(len(wordlist.words) for wordlist in wordlists.itervalues())
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    words = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else multiprocessing.cpu_count()
+
+    path = tempfile.mkdtemp() + os.sep
+
+    try:
+        _make_corpus(path, files, words)
+        print '%d files of %d words, %d CPUs' % (files, words,
+                                                 multiprocessing.cpu_count())
+
+        serial, total = _time(path, 1)
+        print '%-20s %8.2fs %10.0f words/s' % ('serial', serial, total / serial)
+
+        for count in sorted(set([2, workers])):
+            parallel, total = _time(path, count)
+            print '%-20s %8.2fs %10.0f words/s %6.2fx' % (
+                '%d workers' % count, parallel, total / parallel,
+                serial / parallel)
+    finally:
+        shutil.rmtree(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+'''
+Benchmark the memory used by a word list held as a dict of Words with a
+__dict__ (as Word used to be), a dict of Words with __slots__, a SortedWords
+(which a WordList holds by default) and a WordTable.
+
+Memory is measured by adding up the sizes of every object reachable from the
+lists with sys.getsizeof, which doesn't count the allocator's overhead.
+
+Run from the Spellathon directory with:
+
+python -m benchmarks.words_memory [words per list] [lists]
+
+'''
+import gc
+import sys
+from aid.words import SortedWords, Word, WordTable
+
+class DictWord(object):
+    '''A Word as it was before it had __slots__.'''
+    def __init__(self, word, definition, example, difficulty):
+        self.word = word
+        self.definition = definition
+        self.example = example
+        self.difficulty = difficulty
+
+def _lines(words, offset):
+    '''Return the lines of a synthetic tldr file, as they are read from disk
+    with a new line character on the end of each.'''
+    return ['word%d|The definition of word number %d|An example which uses '
+            'word number %d|CL%d\n' % (i, i, i, i % 9)
+            for i in range(offset, offset + words)]
+
+def _dict_words(lines):
+    words = {}
+
+    for line in lines:
+        word = DictWord(*line.split('|'))
+        words[word.word] = word
+
+    return words
+
+def _slot_words(lines):
+    words = {}
+
+    for line in lines:
+        word = Word.deserialise(line)
+        words[word.word] = word
+
+    return words
+
+def _sorted_words(lines):
+    words = SortedWords()
+
+    for line in lines:
+        word = Word.deserialise(line)
+        words[word.word] = word
+
+    return words
+
+def _table_words(lines):
+    words = WordTable()
+
+    for line in lines:
+        word = Word.deserialise(line)
+        words[word.word] = word
+
+    return words
+
+def _reachable_size(root):
+    '''Return the total size of every object reachable from root.'''
+    seen = set()
+    stack = [root]
+    total = 0
+
+    while stack:
+        obj = stack.pop()
+
+        if id(obj) in seen or isinstance(obj, type):
+            continue
+
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+
+    return total
+
+def _measure(build, lines):
+    '''Return the bytes used by the lists built from each set of lines.'''
+    gc.collect()
+    lists = [build(l) for l in lines]
+    return _reachable_size(lists)
+
+def main():
+    words = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    lists = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    lines = [_lines(words, i * words) for i in range(lists)]
+    print '%d lists of %d words' % (lists, words)
+
+    base = None
+
+    for name, build in [('dict of __dict__ Words', _dict_words),
+                        ('dict of __slots__ Words', _slot_words),
+                        ('SortedWords', _sorted_words),
+                        ('WordTable', _table_words)]:
+        size = _measure(build, lines)
+        base = base or size
+        print '%-26s %8.1f MB %6.1f bytes/word %5.0f%%' % (
+            name, size / 1e6, float(size) / (words * lists), 100.0 * size / base)
+
+if __name__ == '__main__':
+    main()
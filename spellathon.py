@@ -1,8 +1,14 @@
+import time
+
+# Time the start of the launch so that the startup report can be made.
+start = time.time()
+
 from aid.views import Initial
 from Tkinter import Tk
 import subprocess
 import tkMessageBox
 import os
+import sys
 import tools.database as db
 
 # List of all the files necessary to run the program.
@@ -59,6 +65,22 @@ def check_files():
         
     return True
 
+def startup_report():
+    '''
+    Write how long Spellathon took to start and how much of that time was
+    spent setting up the database to stderr. Only done when the
+    SPELLATHON_STARTUP_REPORT environment variable is set.
+    '''
+    total = time.time() - start
+    setup = sum(db.timings.values())
+    
+    sys.stderr.write('Startup took %.3fs\n' % total)
+    
+    for step, seconds in sorted(db.timings.items()):
+        sys.stderr.write('  database %s: %.3fs\n' % (step, seconds))
+        
+    sys.stderr.write('  database setup: %.3fs (%.0f%%)\n' % (setup, 100 * setup / total))
+
 if __name__ == '__main__':
     '''Run spellathon.'''
     if check_files() and check_festival():
@@ -66,6 +88,10 @@ if __name__ == '__main__':
         root = Tk()
         root.resizable(False, False)
         init = Initial(root)
+        
+        # Report once the first window has been drawn.
+        if os.environ.get('SPELLATHON_STARTUP_REPORT'):
+            root.after_idle(startup_report)
 
         # Enter the mainloop and begin the program.
         root.mainloop()
\ No newline at end of file
@@ -0,0 +1,83 @@
+'''
+Tests for the word list operations in aid/words.py.
+
+'''
+import unittest
+from aid.words import SortedWords, Word, WordList, WordTable, split_fields
+
+def _wordlist(strings):
+    '''Return a WordList holding a Word for each string.'''
+    wordlist = WordList('test')
+    
+    for string in strings:
+        wordlist._add_word(Word(string, 'definition', 'example', 'CL1'))
+        
+    return wordlist
+
+class FieldsTest(unittest.TestCase):
+    def test_separator_in_fields(self):
+        word = Word('pipe', 'a | b', 'c|d\\', 'CL1')
+        line = word.serialise()
+        
+        self.assertEqual(line, 'pipe|a \\| b|c\\|d\\\\|CL1')
+        self.assertEqual(Word.deserialise(line + '\n').serialise(), line)
+        
+    def test_unescaped_backslash(self):
+        # Lines written before fields were escaped read as they always did.
+        self.assertEqual(split_fields('word|C:\\new|x|CL1'),
+                         ['word', 'C:\\new', 'x', 'CL1'])
+        
+    def test_word_table(self):
+        table = WordTable()
+        table['pipe'] = Word('pipe', 'a | b', 'c\\', 'CL1')
+        
+        self.assertEqual(table['pipe'].definition, 'a | b')
+        self.assertEqual(table['pipe'].example, 'c\\')
+        
+class DifferenceTest(unittest.TestCase):
+    def test_own_words(self):
+        # Removing the list's own words, as "Remove all words" does when no
+        # filter is applied, must not change the words while they are read.
+        wordlist = _wordlist(['apple', 'Bob', 'cat'])
+        words = wordlist.words
+        changes = wordlist.difference(wordlist.words)
+        
+        self.assertEqual(sorted(changes.removed), ['Bob', 'apple', 'cat'])
+        self.assertEqual(len(wordlist.words), 0)
+        self.assertTrue(isinstance(wordlist.words, SortedWords))
+        self.assertEqual(changes.log(), {'apple': None, 'Bob': None,
+                                         'cat': None})
+        self.assertFalse(words is wordlist.words)
+        
+    def test_wordlist(self):
+        wordlist = _wordlist(['apple', 'Bob', 'cat'])
+        changes = wordlist.difference(_wordlist(['Bob', 'dog']))
+        
+        self.assertEqual(list(changes.removed), ['Bob'])
+        self.assertEqual(list(wordlist.words), ['apple', 'cat'])
+        
+    def test_filtered_words(self):
+        wordlist = _wordlist(['apple', 'Bob', 'bee', 'cat'])
+        changes = wordlist.difference(wordlist.words.with_prefix('b'))
+        
+        self.assertEqual(sorted(changes.removed), ['Bob', 'bee'])
+        self.assertEqual(list(wordlist.words), ['apple', 'cat'])
+        
+class MergeTest(unittest.TestCase):
+    def test_sorted_words(self):
+        wordlist = _wordlist(['apple'])
+        changes = wordlist.merge(_wordlist(['Bob', 'apple']).words)
+        
+        self.assertEqual(list(changes.added), ['Bob'])
+        self.assertEqual(list(wordlist.words), ['apple', 'Bob'])
+        
+class IntersectionTest(unittest.TestCase):
+    def test_sorted_words(self):
+        wordlist = _wordlist(['apple', 'Bob', 'cat'])
+        changes = wordlist.intersection(_wordlist(['Bob']).words)
+        
+        self.assertEqual(sorted(changes.removed), ['apple', 'cat'])
+        self.assertEqual(list(wordlist.words), ['Bob'])
+        
+if __name__ == '__main__':
+    unittest.main()
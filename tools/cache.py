@@ -0,0 +1,81 @@
+'''
+Module containing a least recently used cache for objects read from the
+database.
+
+Exported classes:
+
+LRUCache -- A fixed size mapping which forgets the least recently used entries.
+
+'''
+from collections import OrderedDict
+import threading
+
+class LRUCache(object):
+    '''A fixed size mapping which forgets the least recently used entries. It
+    can be shared between threads.
+
+    Public functions:
+    get -- Return the value stored for a key.
+    put -- Store a value for a key.
+    invalidate -- Forget the value stored for a key.
+    clear -- Forget every value.
+    stats -- Return the hit and miss counts of the cache.
+
+    '''
+    def __init__(self, size):
+        '''Create the cache.
+
+        Arguments:
+        size -- The greatest number of entries to keep. A size of 0 turns the
+        cache off.
+
+        '''
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        '''Return the value stored for a key, or default if there isn't one.
+        A found key becomes the most recently used.'''
+        with self.lock:
+            try:
+                value = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self.entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        '''Store a value for a key, forgetting the least recently used entry
+        if the cache is full.'''
+        if self.size <= 0:
+            return
+
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        '''Forget the value stored for a key.'''
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        '''Forget every value.'''
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        '''Return a dictionary of the 'hits', 'misses' and number of
+        'entries' of the cache.'''
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self.entries)}
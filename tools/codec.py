@@ -0,0 +1,121 @@
+'''
+Module to encode word lists in a compact binary format, in which the tldr cache
+keeps its snapshot (see tools/tldr.py).
+
+Each record starts with the version of the format and the kind of record,
+followed by the length of every field and then the fields themselves. Fields
+are never split on a delimiter, so decoding a record is a single struct unpack
+and a slice for each field, which is quicker than parsing the tldr format.
+
+Exported functions:
+
+encode_wordlist -- Encode a WordList and its Words as a binary record.
+decode_wordlist -- Decode a WordList from a binary record.
+
+'''
+import struct
+from aid.words import Word, WordList, WordTable, join_fields
+
+VERSION = 1
+
+# Headers of each kind of record: the version, the kind, then the length of
+# each field.
+WORD_HEADER = struct.Struct('>Bc4I')
+# The fields of a list are its name, source, date edited and its words, which
+# are stored as consecutive Word records.
+LIST_HEADER = struct.Struct('>Bc4I')
+
+def _encode(header, kind, fields):
+    '''Encode a list of fields behind a header.'''
+    # Fields are stored as UTF-8 bytes.
+    fields = [field.encode('utf-8') if isinstance(field, unicode) else str(field)
+              for field in fields]
+    lengths = [len(field) for field in fields]
+
+    return header.pack(VERSION, kind, *lengths) + ''.join(fields)
+
+def _decode(header, kind, data, offset=0):
+    '''Decode the fields of the record starting at an offset.
+
+    Returns:
+    A tuple of the list of fields and the offset of the end of the record.
+
+    '''
+    parts = header.unpack_from(data, offset)
+
+    if parts[0] != VERSION or parts[1] != kind:
+        raise ValueError('Not a version %d %s record' % (VERSION, kind))
+
+    fields = []
+    start = offset + header.size
+
+    for length in parts[2:]:
+        fields.append(data[start:start + length])
+        start += length
+
+    return fields, start
+
+def _encode_word(word):
+    '''Encode a Word as a binary record.'''
+    return _encode(WORD_HEADER, 'W', [word.word, word.definition, word.example,
+                                      word.difficulty])
+
+def encode_wordlist(wordlist):
+    '''Encode a WordList, including its Words, as a binary record.'''
+    return _encode(LIST_HEADER, 'L', [wordlist.name, wordlist.source,
+                                      wordlist.date_edited,
+                                      ''.join([_encode_word(word) for word in
+                                               wordlist.words.itervalues()])])
+
+def decode_wordlist(data, offset=0, compact=False):
+    '''Decode the WordList record made by encode_wordlist starting at an
+    offset.
+
+    Arguments:
+    data -- A string or buffer containing the record.
+    offset -- The offset the record starts at.
+    compact -- If True, the words are decoded into a WordTable, without
+    building a Word for each.
+
+    Returns:
+    A tuple of the WordList and the offset of the end of the record.
+
+    '''
+    fields, end = _decode(LIST_HEADER, 'L', data, offset)
+
+    # The Word records are decoded here with everything the loop uses in local
+    # variables, as lists are decoded a whole snapshot at a time.
+    records = fields[3]
+    unpack_from = WORD_HEADER.unpack_from
+    size = WORD_HEADER.size
+    offset = 0
+
+    if compact:
+        words = WordTable()
+        rows = words.rows
+    else:
+        words = {}
+
+    while offset < len(records):
+        version, kind, a, b, c, d = unpack_from(records, offset)
+
+        if version != VERSION or kind != 'W':
+            raise ValueError('Not a version %d W record' % VERSION)
+
+        e = offset + size + a
+        f = e + b
+        g = f + c
+        offset = g + d
+
+        string = records[e - a:e]
+
+        if compact:
+            # The rows of a WordTable are the other fields joined as in the
+            # tldr format.
+            rows[string] = join_fields((records[e:f], records[f:g],
+                                        records[g:offset]))
+        else:
+            words[string] = Word(string, records[e:f], records[f:g],
+                                 records[g:offset])
+
+    return WordList(fields[0], fields[1], fields[2], words), end
@@ -1,80 +1,540 @@
 '''
-Handle the word and user tables in the Spellathon database.
+Handle the word, user and list tables in the Spellathon database. The layout of
+the tables is described in tools/migrations.py.
 
 '''
 import sqlite3 as sqlite
+import Queue
+import atexit
+import datetime
+import itertools
 import os
+import re
+import sys
+import threading
+import time
+import tools.migrations as migrations
+import tools.profiler as profiling
+from tools.profiler import ProfiledConnection
+from tools.cache import LRUCache
 from aid.user import User
-from aid.words import Word
+from aid.words import Word, WordList
 
-'''Initialisation script to create the tables if the database file is not found.
-The primary key of a word record is the word itslf, associated with a word
-object which contains the related metadata.
+# Seconds a connection waits for another connection to release a lock.
+BUSY_TIMEOUT = 5.0
 
-The primary key of a user record is the username, associated with a User object
-which keeps track of the scores and details of the user.
+# Number of times a statement is tried while the database stays locked, and the
+# delay before the first retry.
+RETRIES = 3
+RETRY_DELAY = 0.1
 
-This schema is horrible but it works.
-'''
+# Journal mode and synchronous level set on every connection, with the
+# SPELLATHON_JOURNAL_MODE and SPELLATHON_SYNCHRONOUS environment variables. The
+# defaults, DELETE and FULL, are SQLite's own and are safe wherever the database
+# is kept, including a drive shared over the network. WAL with synchronous at
+# NORMAL is faster, as readers are never blocked by a writer and a commit
+# doesn't wait for the disk. But WAL keeps its index in shared memory, which
+# doesn't work between computers sharing a network drive, and can then corrupt
+# the database. Only turn it on when every copy of Spellathon using the database
+# runs on the computer whose disk holds it.
+JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+SYNCHRONOUS_LEVELS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
 
-INIT = '''
-CREATE TABLE 'words' (
-    'string' VARCHAR(96) PRIMARY KEY,
-    'word' Word
-);
+def _setting(variable, default, allowed):
+    '''Return the value of an environment variable naming a database setting,
+    or the default if it isn't set or isn't one of the allowed values.'''
+    value = (os.environ.get(variable) or default).upper()
+    
+    if value not in allowed:
+        sys.stderr.write('Ignoring %s=%s, which should be one of %s\n'
+                         % (variable, value, ', '.join(allowed)))
+        return default
+    
+    return value
 
-CREATE TABLE 'users' (
-    'username' VARCHAR(96) PRIMARY KEY,
-    'user' User
-);
-'''
+JOURNAL_MODE = _setting('SPELLATHON_JOURNAL_MODE', 'DELETE', JOURNAL_MODES)
+SYNCHRONOUS = _setting('SPELLATHON_SYNCHRONOUS', 'FULL', SYNCHRONOUS_LEVELS)
+
+# Seconds over which score writes are gathered into a single commit by a
+# background thread, set with the SPELLATHON_GROUP_COMMIT environment variable.
+# By default (0) scores are written on the caller's connection and committed
+# with the rest of its changes. Group committed scores are committed on a
+# connection of their own, so they can't be discarded with the caller's
+# changes, and they wait for any write lock the caller holds. Reading scores
+# waits for the group to be committed first, for up to BUSY_TIMEOUT, and as
+# scores are read on the Tk thread the interface can stall for that long while
+# the database is locked.
+GROUP_COMMIT_WINDOW = float(os.environ.get('SPELLATHON_GROUP_COMMIT', 0))
+
+# Number of rows written by each executemany call of a bulk insert.
+BATCH_SIZE = 1000
+
+# Number of words add_words writes with the full text index kept up to date by
+# its triggers. Beyond this the triggers are dropped and the index is rebuilt
+# once all of the words are written.
+BULK_INDEX_THRESHOLD = 10000
+
+# Number of users and words kept in the record caches of the managers.
+USER_CACHE_SIZE = 256
+WORD_CACHE_SIZE = 4096
+
+# Keys and values with a special meaning in the record caches. ALL is the key
+# of the list of every user, MISSING is cached for records that weren't found,
+# and NOT_CACHED is returned when nothing is cached for a key.
+ALL = ('all',)
+MISSING = object()
+NOT_CACHED = object()
+
+# Default number of results returned by a word search.
+SEARCH_LIMIT = 50
 
+# Pattern splitting a search query into "quoted phrases" and single terms.
+SEARCH_TERM = re.compile(r'"([^"]+)"|([^\s"]+)')
+
+# A letter or digit, which the full text index splits words into tokens of.
+WORD_TOKEN = re.compile(r'[^\W_]', re.UNICODE)
+
+# Columns of the users table in the order taken by the User constructor.
+SELECT_USERS = 'SELECT username, realname, password, dob, photo FROM users '
+
+# Columns of the words table in the order taken by the Word constructor.
+SELECT_WORDS = 'SELECT string, definition, example, difficulty FROM words '
+
+# The target of a statement inserting a word from the same columns. The id of
+# the word is chosen by SQLite.
+INSERT_WORD = ('INTO words (string, definition, example, difficulty) '
+               'VALUES (?, ?, ?, ?)')
+
+def retry(function, *args):
+    '''Call a database function, trying again if another connection holds a
+    lock on the database for longer than the busy timeout.'''
+    for attempt in range(RETRIES):
+        try:
+            return function(*args)
+        except sqlite.OperationalError as e:
+            if 'locked' not in str(e) or attempt == RETRIES - 1:
+                raise
+            
+            # Back off a little more after each failure.
+            time.sleep(RETRY_DELAY * 2 ** attempt)
+
+class _ConnectionProvider(object):
+    '''Give each thread its own connection to the database, as a sqlite3
+    connection can only be used by the thread that created it.
+    
+    Public functions:
+    connection -- Return the connection of the current thread.
+    cursor -- Return the cursor of the current thread.
+    new_cursor -- Return a new cursor on the connection of the current thread.
+    close -- Close the connection of the current thread.
+    write -- Write a row, gathering writes into group commits if enabled.
+    flush -- Wait for gathered writes to be committed.
+    
+    '''
+    def __init__(self, path='spellingaid.db', timeout=BUSY_TIMEOUT,
+                 journal_mode=JOURNAL_MODE, synchronous=SYNCHRONOUS,
+                 group_commit=GROUP_COMMIT_WINDOW, profiler=None):
+        '''Create the connection provider.
+        
+        Arguments:
+        path -- The path of the database file.
+        timeout -- Seconds to wait for another connection to release a lock
+        before giving up.
+        journal_mode -- The journal mode to use (WAL, DELETE etc).
+        synchronous -- The synchronous level to use (OFF, NORMAL, FULL).
+        group_commit -- Seconds over which to gather writes into one commit, or
+        0 to commit each write with the rest of the caller's changes.
+        profiler -- A tools.profiler.QueryProfiler to report every statement
+        to (optional).
+        
+        '''
+        self.path = path
+        self.timeout = timeout
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.profiler = profiler
+        self.local = threading.local()
+        
+        if group_commit:
+            self.committer = _GroupCommitter(self, group_commit)
+        else:
+            self.committer = None
+        
+        # Only the first connection made needs to check the tables are up to
+        # date, and no other thread should use the database until it has.
+        self.lock = threading.Lock()
+        self.migrated = False
+        
+    def connection(self):
+        '''Return the connection of the current thread, connecting to the
+        database if the thread hasn't used it before.'''
+        try:
+            return self.local.db
+        except AttributeError:
+            pass
+        
+        start = time.time()
+        
+        # If profiling is turned on, every statement, commit and rollback on
+        # the connection is reported to the profiler.
+        if self.profiler:
+            db = sqlite.connect(self.path, timeout=self.timeout,
+                                detect_types=sqlite.PARSE_DECLTYPES,
+                                factory=ProfiledConnection)
+            db.profiler = self.profiler
+        else:
+            db = sqlite.connect(self.path, timeout=self.timeout,
+                                detect_types=sqlite.PARSE_DECLTYPES)
+        
+        db.text_factory = str
+        db.execute('PRAGMA journal_mode=' + self.journal_mode)
+        db.execute('PRAGMA synchronous=' + self.synchronous)
+        _add_timing('connect', time.time() - start)
+        
+        # Create the tables if the database is new, or upgrade them if it was
+        # made by an older version of Spellathon.
+        with self.lock:
+            if not self.migrated:
+                start = time.time()
+                migrations.migrate(db)
+                self.migrated = True
+                _add_timing('migrate', time.time() - start)
+        
+        self.local.db = db
+        self.local.c = db.cursor()
+        
+        return db
+    
+    def cursor(self):
+        '''Return the cursor of the current thread.'''
+        self.connection()
+        return self.local.c
+    
+    def new_cursor(self):
+        '''Return a new cursor on the connection of the current thread, for
+        queries whose rows are read while other statements are run.'''
+        return self.connection().cursor()
+    
+    def close(self):
+        '''Close the connection of the current thread, if it has one.'''
+        try:
+            db = self.local.db
+        except AttributeError:
+            return
+        
+        del self.local.db
+        del self.local.c
+        db.close()
+        
+    def write(self, sql, parameters):
+        '''Write a row. If group commits are enabled the write is handed to
+        the background thread, which commits it along with any other writes
+        made within the window. Otherwise it is executed on the connection of
+        the current thread and committed with the rest of its changes.
+        
+        Arguments:
+        sql -- The statement to execute.
+        parameters -- The parameters of the statement.
+        
+        '''
+        if self.committer:
+            self.committer.put(sql, parameters)
+        else:
+            retry(self.cursor().execute, sql, parameters)
+            
+    def flush(self, timeout=None):
+        '''Wait for any gathered writes to be committed.
+        
+        Arguments:
+        timeout -- The most seconds to wait, or None to wait until they are.
+        
+        Returns:
+        False if some writes were still waiting when the timeout ran out,
+        otherwise True.
+        
+        '''
+        if self.committer:
+            return self.committer.flush(timeout)
+        
+        return True
+            
+class _GroupCommitter(object):
+    '''A background thread which gathers the writes made within a short
+    window and commits them together, so that the thread making the writes
+    never waits for the disk.
+    
+    Public functions:
+    put -- Queue a write.
+    flush -- Wait for every queued write to be committed.
+    
+    '''
+    def __init__(self, provider, window):
+        '''Create the group committer. The thread is started by the first
+        write.
+        
+        Arguments:
+        provider -- The _ConnectionProvider to get the thread's connection
+        from.
+        window -- Seconds to keep gathering writes after the first one.
+        
+        '''
+        self.provider = provider
+        self.window = window
+        self.queue = Queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        # The number of writes queued but not yet committed, and a condition
+        # notified whenever it falls.
+        self.pending = 0
+        self.committed = threading.Condition(threading.Lock())
+        
+    def put(self, sql, parameters):
+        '''Queue a write to be committed with the next group.'''
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+                
+                # Make sure the last group is committed when Spellathon exits.
+                atexit.register(self._flush_at_exit)
+        
+        with self.committed:
+            self.pending += 1
+            
+        self.queue.put((sql, parameters))
+        
+    def flush(self, timeout=None):
+        '''Wait for every queued write to be committed.
+        
+        Arguments:
+        timeout -- The most seconds to wait, or None to wait until they are.
+        
+        Returns:
+        False if some writes were still waiting when the timeout ran out,
+        otherwise True.
+        
+        '''
+        deadline = timeout is not None and time.time() + timeout
+        
+        with self.committed:
+            while self.pending:
+                if deadline is False:
+                    self.committed.wait()
+                elif deadline > time.time():
+                    self.committed.wait(deadline - time.time())
+                else:
+                    return False
+                
+        return True
+    
+    def _flush_at_exit(self):
+        '''Give the last writes as long to commit as a write on the caller's
+        connection would get, rather than hanging the exit.'''
+        if not self.flush(self.provider.timeout * RETRIES):
+            sys.stderr.write('%d score writes were not committed before exit\n'
+                             % self.pending)
+        
+    def _run(self):
+        '''Gather and commit groups of writes for as long as the program
+        runs. A group which can't be committed because the database stays
+        locked is kept and tried again, along with any writes made since.'''
+        writes = []
+        failures = 0
+        
+        while True:
+            if not writes:
+                writes.append(self.queue.get())
+                
+            deadline = time.time() + self.window
+            
+            # Keep gathering until the window closes.
+            while True:
+                remaining = deadline - time.time()
+                
+                if remaining <= 0:
+                    break
+                
+                try:
+                    writes.append(self.queue.get(timeout=remaining))
+                except Queue.Empty:
+                    break
+            
+            try:
+                done = self._commit(writes)
+            except sqlite.OperationalError as e:
+                self.provider.connection().rollback()
+                failures += 1
+                sys.stderr.write('Group commit of %d writes failed, trying '
+                                 'again: %s\n' % (len(writes), e))
+                # Back off further after each failure, up to the window.
+                time.sleep(min(RETRY_DELAY * 2 ** failures, max(self.window, 1.0)))
+                continue
+            
+            failures = 0
+            writes = []
+            
+            with self.committed:
+                self.pending -= done
+                self.committed.notify_all()
+                
+    def _commit(self, writes):
+        '''Execute and commit a group of writes on the thread's connection.
+        
+        Returns:
+        The number of writes dealt with.
+        
+        '''
+        db = self.provider.connection()
+        cursor = self.provider.cursor()
+        
+        for sql, parameters in writes:
+            try:
+                retry(cursor.execute, sql, parameters)
+            except sqlite.OperationalError:
+                # Most likely the database is locked, so the whole group
+                # is tried again.
+                raise
+            except sqlite.Error as e:
+                # The write itself is at fault, such as by breaking a
+                # constraint, so trying it again would fail every time.
+                sys.stderr.write('Score write %r failed: %s\n' % (parameters, e))
+                
+        retry(db.commit)
+        return len(writes)
+        
 class _DBManager(object):
     '''Abstract base class which implements committing and discarding database changes,
     as well as instantiation in the case where the database does not exist.
     
+    Each thread works through its own connection and cursor, so a manager can
+    be used from worker threads as well as the Tk thread. Changes are committed
+    or discarded separately for each thread.
+    
+    Records that are read are kept in a cache shared by every thread, and
+    forgotten when they are changed. The whole cache is forgotten whenever
+    another connection, in this process or another, commits a change.
+    
     Public functions:
     commit -- Save changes made to the database and close the cursor.
     discard -- Discard changes made to the database and close the cursor.
+    cache_stats -- Return the hit and miss counts of the record cache.
     
     '''
-    def __init__(self):
-        # Boolean to record whether the database exists. We need this because
-        # we need to check if the db file exists in the file system before we
-        # connect to the database.
-        exists = False
+    def __init__(self, provider, cache_size):
+        '''Create the manager.
         
-        # Check if the database exists in the file system.
-        if os.path.isfile('spellingaid.db'):
-            exists = True
+        Arguments:
+        provider -- The _ConnectionProvider to get connections from.
+        cache_size -- The number of records to cache, or 0 for none.
         
-        # Connect to the database and create a cursor.
-        self.db = sqlite.connect('spellingaid.db', detect_types = sqlite.PARSE_DECLTYPES)
-        self.db.text_factory = str
-        self.c = self.db.cursor()
+        '''
+        self.provider = provider
+        self.cache = LRUCache(cache_size)
+        self.listeners = []
+        # The data_version last seen on the connection of each thread.
+        self.versions = threading.local()
         
-        # If the database didn't exist, initialise the tables.
-        if not exists:
-            self.db.executescript(INIT)
+    @property
+    def db(self):
+        '''The connection of the current thread.'''
+        return self.provider.connection()
+    
+    @property
+    def c(self):
+        '''The cursor of the current thread.'''
+        return self.provider.cursor()
+    
+    def _check_cache(self):
+        '''Forget every cached record if another connection has committed a
+        change since the cache was last checked from this thread, as the
+        records, or the ones found to be missing, may have changed.'''
+        version = self.db.execute('PRAGMA data_version').fetchone()[0]
         
-        # Register adapters and converters to let the database work with User
-        # and Word objects.
-        sqlite.register_adapter(User, lambda u : u.serialise())
-        sqlite.register_adapter(Word, lambda w : w.serialise())
+        if getattr(self.versions, 'last', version) != version:
+            self.cache.clear()
         
-        sqlite.register_converter('User', User.deserialise)
-        sqlite.register_converter('Word', Word.deserialise)
+        self.versions.last = version
         
-        self.listeners = []
+    def _execute(self, sql, parameters=()):
+        '''Execute a statement on the cursor of the current thread.'''
+        return retry(self.c.execute, sql, parameters)
+    
+    def _executemany(self, sql, rows):
+        '''Execute a statement for each row on the cursor of the current
+        thread.'''
+        return retry(self.c.executemany, sql, rows)
+        
+    def _iter_rows(self, select, key, conditions=(), parameters=(),
+                   batch_size=BATCH_SIZE, keyset=False):
+        '''Yield the rows of a query, fetching them in batches so that the
+        whole result is never held in memory.
+        
+        Arguments:
+        select -- The SELECT and FROM clauses of the query.
+        key -- The unique column the rows are ordered by, which must be the
+        first column selected.
+        conditions -- Conditions the rows must meet.
+        parameters -- The parameters of the conditions.
+        batch_size -- The number of rows fetched at a time.
+        keyset -- If True, each batch is fetched by a separate query for the
+        rows after the last key seen, rather than by one query held open until
+        the last row. Use this if changes may be committed before the
+        iteration finishes, as committing resets any open query.
+        
+        '''
+        # Each iteration uses its own cursor, so that the manager can be used
+        # between rows.
+        cursor = self.provider.new_cursor()
+        conditions = list(conditions)
+        parameters = list(parameters)
+        
+        if not keyset:
+            where = ' AND '.join(conditions)
+            retry(cursor.execute, select + (where and 'WHERE ' + where + ' ') +
+                  'ORDER BY ' + key, parameters)
+        
+        last = None
+        
+        while True:
+            if keyset:
+                where = conditions[:]
+                arguments = parameters[:]
+                
+                if last is not None:
+                    where.append(key + ' > ?')
+                    arguments.append(last)
+                
+                where = ' AND '.join(where)
+                retry(cursor.execute, select + (where and 'WHERE ' + where + ' ') +
+                      'ORDER BY ' + key + ' LIMIT ?', arguments + [batch_size])
+                
+            rows = cursor.fetchmany(batch_size)
+            
+            if not rows:
+                return
+            
+            for row in rows:
+                yield row
+            
+            last = rows[-1][0]
         
     def commit(self):
         '''Save changes made to the database and close the cursor.'''
-        self.db.commit()
+        retry(self.db.commit)
         
     def discard(self):
         '''Discard changes made to the database and close the cursor.'''
         self.db.rollback()
         
+        # Records read since the changes were made may have been cached.
+        self.cache.clear()
+        
+    def cache_stats(self):
+        '''Return a dictionary of the 'hits', 'misses' and number of
+        'entries' of the record cache.'''
+        return self.cache.stats()
+        
     def add_listener(self, listener):
         self.listeners.append(listener)
         
@@ -91,7 +551,12 @@ class _UserManager(_DBManager):
     retrieve_user -- Find and return individual User objects.
     retrieve_users -- Find and return a list of all User objects in the database.
     retrieve_usernames -- Find and return a list of all usernames.
-    remove_user -- Remove a user from the database.
+    iter_users -- Iterate over every User object in the database.
+    iter_usernames -- Iterate over every username.
+    remove_user -- Remove a user and their scores from the database.
+    add_score -- Record the score of a user for one play of a list.
+    high_score -- Find the high score of a user for a list.
+    attempts -- Find the number of times a user has played a list.
     
     '''
     def add_user(self, user):
@@ -106,7 +571,10 @@ class _UserManager(_DBManager):
         
         '''
         try:
-            self.c.execute('INSERT INTO users VALUES (?, ?)', (user.username, user))
+            self._execute('INSERT INTO users VALUES (?, ?, ?, ?, ?)',
+                          (user.username, user.realname, user.password,
+                           user.dob, user.photo))
+            self._invalidate(user.username)
             self.user_added(user)
             return True
         except sqlite.IntegrityError:
@@ -119,7 +587,10 @@ class _UserManager(_DBManager):
         user -- A User object representing a Spellathon user.
         
         '''
-        self.c.execute('UPDATE users SET user=? WHERE username=?', (user, user.username))
+        self._execute('UPDATE users SET realname=?, password=?, dob=?, photo=? '
+                      'WHERE username=?', (user.realname, user.password,
+                                           user.dob, user.photo, user.username))
+        self._invalidate(user.username)
             
     def retrieve_user(self, user):
         '''Retrieve a User object from the database.
@@ -132,16 +603,28 @@ class _UserManager(_DBManager):
         
         '''       
         try:
-            self.c.execute('SELECT user FROM users WHERE username=?', (user.username,))
+            username = user.username
         except AttributeError:
-            self.c.execute('SELECT user FROM users WHERE username=?', (user,))
+            username = user
+        
+        # Users that weren't found are cached too, as MISSING.
+        self._check_cache()
+        cached = self.cache.get(username, NOT_CACHED)
+        
+        if cached is not NOT_CACHED:
+            return None if cached is MISSING else cached
+        
+        self._execute(SELECT_USERS + 'WHERE username=?', (username,))
         
         users = self.c.fetchone()
         
-        # Take index 0 of the row tuple, rather than returning the tuple.
+        # Build the User from the columns of the row.
         if users:
-            return users[0]
+            user = User(*users)
+            self.cache.put(username, user)
+            return user
         else:
+            self.cache.put(username, MISSING)
             return None
             
     def retrieve_users(self):
@@ -151,15 +634,22 @@ class _UserManager(_DBManager):
         The list of all Spellathon users.
         
         '''
-        self.c.execute('SELECT user FROM users')
-        
-        users = []
+        self._check_cache()
+        users = self.cache.get(ALL)
         
-        # Take index 0 of the row tuple, rather than returning the tuple.
-        for row in self.c:
-            users.append(row[0])
+        if users is None:
+            self._execute(SELECT_USERS)
+            
+            users = []
+            
+            # Build a User from the columns of each row.
+            for row in self.c:
+                users.append(User(*row))
+            
+            self.cache.put(ALL, users)
         
-        return users
+        # Copy the list so that callers can't change the cached one.
+        return list(users)
         
     def retrieve_usernames(self):
         '''Retrieve all usernames from the database.
@@ -168,27 +658,103 @@ class _UserManager(_DBManager):
         The list of all Spellathon users usernames.
         
         '''
-        self.c.execute('SELECT username FROM users')
+        return list(self.iter_usernames())
         
-        usernames = []
-
-        # Take index 0 of the row tuple, rather than returning the tuple.
-        for row in self.c:
-            usernames.append(row[0])
+    def iter_users(self, batch_size=BATCH_SIZE, keyset=False):
+        '''Iterate over every User object in the database in order of username,
+        reading them in batches. The users aren't cached.
+        
+        Arguments:
+        batch_size -- The number of users read at a time.
+        keyset -- If True, read each batch with a separate query (see
+        _DBManager._iter_rows).
+        
+        Returns:
+        A generator of User objects.
+        
+        '''
+        for row in self._iter_rows(SELECT_USERS, 'username',
+                                   batch_size=batch_size, keyset=keyset):
+            yield User(*row)
             
-        return usernames
+    def iter_usernames(self, batch_size=BATCH_SIZE, keyset=False):
+        '''Iterate over every username in the database in order, reading them
+        in batches.
+        
+        Arguments:
+        batch_size -- The number of usernames read at a time.
+        keyset -- If True, read each batch with a separate query (see
+        _DBManager._iter_rows).
+        
+        Returns:
+        A generator of usernames.
+        
+        '''
+        # Take index 0 of the row tuple, rather than returning the tuple.
+        for row in self._iter_rows('SELECT username FROM users ', 'username',
+                                   batch_size=batch_size, keyset=keyset):
+            yield row[0]
             
     def remove_user(self, user):
-        ''' Remove a user from the database.
+        ''' Remove a user and their scores from the database.
         
         Arguments:
         user -- A User object or username representing a Spellathon user.
         
         '''     
         try:
-            self.c.execute('DELETE FROM users WHERE username=?', (user.username,))
+            username = user.username
         except AttributeError:
-            self.c.execute('DELETE FROM users WHERE username=?', (user,))
+            username = user
+            
+        self._execute('DELETE FROM users WHERE username=?', (username,))
+        self._execute('DELETE FROM scores WHERE username=?', (username,))
+        self._invalidate(username)
+        
+    def _invalidate(self, username):
+        '''Forget the cached records affected by a change to a user.'''
+        self.cache.invalidate(username)
+        self.cache.invalidate(ALL)
+        
+    def add_score(self, user, list, score):
+        '''Record the score of a user for one play of a list.
+        
+        Arguments:
+        user -- The User object of the player.
+        list -- The name of the list which the user played.
+        score -- The score they achieved.
+        
+        The score is committed by the next call to commit, unless group
+        commits are turned on (see GROUP_COMMIT_WINDOW), in which case the
+        group commit thread commits it.
+        
+        '''
+        self.provider.write('INSERT INTO scores VALUES (?, ?, ?, ?)',
+                            (user.username, list, score, datetime.datetime.now()))
+        
+    def high_score(self, user, list):
+        '''Return the high score of a user for a given list. Returns 0 if the
+        user hasn't played the list.'''
+        self._flush_scores()
+        self._execute('SELECT MAX(score) FROM scores WHERE username=? AND list=?',
+                      (user.username, list))
+        
+        return self.c.fetchone()[0] or 0
+        
+    def attempts(self, user, list):
+        '''Return the number of times a user has played a given list.'''
+        self._flush_scores()
+        self._execute('SELECT COUNT(*) FROM scores WHERE username=? AND list=?',
+                      (user.username, list))
+        
+        return self.c.fetchone()[0]
+    
+    def _flush_scores(self):
+        '''Wait for any group committed scores, so that they are counted.
+        The wait is limited to the busy timeout, as the group may itself be
+        waiting for a write lock held by this thread. When called from the Tk
+        thread the interface doesn't respond while it waits.'''
+        self.provider.flush(self.provider.timeout)
             
     def user_added(self, user):
         if self.listeners:
@@ -200,9 +766,13 @@ class _WordManager(_DBManager):
     
     Public functions:
     _add_word -- Add a word to the database.
+    add_words -- Add many words to the database at once.
     retrieve_word -- Find and return individual Word objects.
+    retrieve_words -- Find and return a list of all Word objects.
+    iter_words -- Iterate over every Word object, or those of a difficulty.
     retrieve_words_of_difficulty -- Retrieve a list of 
     all words of a given difficulty.
+    search_words -- Find words whose word, definition or example match a query.
     _remove_word -- Remove a given word.
     
     '''
@@ -218,11 +788,112 @@ class _WordManager(_DBManager):
         
         '''
         try:
-            self.c.execute('INSERT INTO words VALUES (?, ?)', (word.word, word))
+            self._execute('INSERT ' + INSERT_WORD,
+                          (word.word, word.definition, word.example,
+                           word.difficulty.strip()))
+            self.cache.invalidate(word.word)
             return True
         except sqlite.IntegrityError:
             return False
 
+    def add_words(self, words, update=False):
+        '''Add many words to the database in a single transaction.
+        
+        Arguments:
+        words -- An iterable of Word objects or (word, definition, example,
+        difficulty) tuples, such as the generator returned by
+        tools.tldr.read_word_records. It is consumed in batches, so it is never
+        held in memory all at once.
+        update -- If True, words which are already in the database have their
+        metadata replaced. Otherwise they are skipped.
+        
+        Returns:
+        A dictionary containing the number of words 'inserted', 'updated' and
+        'skipped', the 'seconds' taken and the 'rate' in words per second.
+        
+        '''
+        start = time.time()
+        counts = {'inserted': 0, 'updated': 0, 'skipped': 0}
+        # The number of words written so far, and whether the full text index
+        # triggers have been dropped for the rest of them.
+        done = 0
+        bulk = False
+        
+        # Anything already written on this connection is committed first, as
+        # it always was by the commit at the end. The words are then written
+        # in a transaction of their own, begun by hand because the sqlite3
+        # module would otherwise commit before dropping the triggers.
+        self.commit()
+        db = self.db
+        isolation_level = db.isolation_level
+        db.isolation_level = None
+        
+        # As in migrations.migrate, the transaction is begun before the try
+        # below, so a lock error isn't hidden by a failed rollback.
+        try:
+            self._execute('BEGIN IMMEDIATE')
+        except:
+            db.isolation_level = isolation_level
+            raise
+        
+        try:
+            for batch in _batches(words, BATCH_SIZE):
+                if (not bulk and done >= BULK_INDEX_THRESHOLD and
+                    self._has_search_index()):
+                    # Updating the index for each word makes large ingests
+                    # many times slower than rebuilding it once at the end.
+                    migrations.drop_search_triggers(db)
+                    bulk = True
+                    
+                rows = []
+                
+                # Build the rows, normalising the difficulty in the same way
+                # as _add_word.
+                for word in batch:
+                    try:
+                        row = (word.word, word.definition, word.example,
+                               word.difficulty)
+                    except AttributeError:
+                        row = tuple(word)
+                    
+                    rows.append(row[:3] + (row[3].strip(),))
+                
+                if update:
+                    # Update the words that already exist first, so that
+                    # the insert below only adds the new ones.
+                    self._executemany('UPDATE words SET definition=?, example=?, '
+                                      'difficulty=? WHERE string=?',
+                                      [row[1:] + row[:1] for row in rows])
+                    counts['updated'] += self.c.rowcount
+                    
+                self._executemany('INSERT OR IGNORE ' + INSERT_WORD, rows)
+                counts['inserted'] += self.c.rowcount
+                counts['skipped'] += len(rows)
+                done += len(rows)
+                
+            if bulk:
+                self._execute("INSERT INTO words_fts(words_fts) VALUES ('rebuild')")
+                migrations.create_search_triggers(db)
+                
+            self._execute('COMMIT')
+        except:
+            # The triggers are restored along with the words table.
+            self._execute('ROLLBACK')
+            raise
+        finally:
+            db.isolation_level = isolation_level
+            # Any of the words may have been cached.
+            self.cache.clear()
+        
+        # Anything that was neither inserted nor updated was skipped.
+        counts['skipped'] -= counts['inserted'] + counts['updated']
+        counts['seconds'] = time.time() - start
+        
+        total = counts['inserted'] + counts['updated'] + counts['skipped']
+        counts['rate'] = total / counts['seconds'] if counts['seconds'] else 0.0
+        
+        return counts
+        
     def retrieve_word(self, word):
         '''Retrieve a given word from the database.
         
@@ -234,16 +905,28 @@ class _WordManager(_DBManager):
         
         '''
         try:
-            self.c.execute('SELECT word FROM words WHERE string=?', (word.word,))
+            string = word.word
         except AttributeError:
-            self.c.execute('SELECT word FROM words WHERE string=?', (word,))
+            string = word
+        
+        # Words that weren't found are cached too, as MISSING.
+        self._check_cache()
+        cached = self.cache.get(string, NOT_CACHED)
+        
+        if cached is not NOT_CACHED:
+            return None if cached is MISSING else cached
+        
+        self._execute(SELECT_WORDS + 'WHERE string=?', (string,))
         
         word = self.c.fetchone()
 
-        # Take index 0 of the row tuple, rather than returning the tuple.
+        # Build the Word from the columns of the row.
         if word:
-            return word[0]
+            word = Word(*word)
+            self.cache.put(string, word)
+            return word
         else:
+            self.cache.put(string, MISSING)
             return None
         
     def retrieve_words(self):
@@ -253,15 +936,30 @@ class _WordManager(_DBManager):
         The list of all words.
         
         '''
-        self.c.execute('SELECT word FROM words')
+        return list(self.iter_words())
         
-        words = []
+    def iter_words(self, difficulty=None, batch_size=BATCH_SIZE, keyset=False):
+        '''Iterate over the Word objects in the database in order, reading them
+        in batches. The words aren't cached.
         
-        # Take index 0 of the row tuple, rather than returning the tuple.
-        for row in self.c:
-            words.append(row[0])
+        Arguments:
+        difficulty -- Only iterate over words of this difficulty (optional).
+        batch_size -- The number of words read at a time.
+        keyset -- If True, read each batch with a separate query (see
+        _DBManager._iter_rows).
         
-        return words
+        Returns:
+        A generator of Word objects.
+        
+        '''
+        if difficulty:
+            conditions, parameters = ['difficulty=?'], [difficulty]
+        else:
+            conditions, parameters = [], []
+        
+        for row in self._iter_rows(SELECT_WORDS, 'string', conditions,
+                                   parameters, batch_size, keyset):
+            yield Word(*row)
         
     def retrieve_words_of_difficulty(self, difficulty):
         '''Retrieve all words of a given difficulty from the database.
@@ -273,17 +971,142 @@ class _WordManager(_DBManager):
         A list of word objects with the given difficulty.
         
         '''
-        self.c.execute('SELECT word FROM words')
+        # Only the rows with the requested difficulty are read, using the
+        # difficulty index.
+        self._execute(SELECT_WORDS + 'WHERE difficulty=?', (difficulty,))
         
         words = []
         
-        # For all words in the database, if the word has the requested
-        # difficulty, add that word to the list to be returned.
         for row in self.c:
-            if row[0].difficulty.strip() == difficulty:
-                words.append(row[0])
+            words.append(Word(*row))
         
         return words
+    
+    def words_with_prefix(self, prefix, difficulties=None):
+        '''Find every word which starts with a prefix, ignoring case.
+        
+        Arguments:
+        prefix -- The text the words start with.
+        difficulties -- Only find words of these difficulties (optional).
+        
+        Returns:
+        A list of the matching Word objects, in no particular order.
+        
+        '''
+        if self._has_search_index() and WORD_TOKEN.search(prefix):
+            # The prefix index on the word column finds every word with a
+            # token starting with the prefix. That includes every word which
+            # starts with it, and the rest are dropped below.
+            sql = ('SELECT words.string, words.definition, words.example, '
+                   'words.difficulty FROM words_fts JOIN words '
+                   'ON words.id = words_fts.rowid WHERE words_fts MATCH ? ')
+            parameters = ['string : "%s"*' % prefix.replace('"', '""')]
+            # As in search_words, the difficulty index mustn't be used.
+            difficulty_column = '+words.difficulty'
+        else:
+            # LIKE ignores the case of ASCII letters.
+            escaped = (prefix.replace('\\', '\\\\').replace('%', '\\%')
+                             .replace('_', '\\_'))
+            sql = SELECT_WORDS + "WHERE string LIKE ? ESCAPE '\\' "
+            parameters = [escaped + '%']
+            difficulty_column = 'difficulty'
+        
+        if difficulties:
+            sql += 'AND %s IN (%s) ' % (difficulty_column,
+                                        ', '.join('?' * len(difficulties)))
+            parameters.extend(difficulties)
+        
+        self._execute(sql, parameters)
+        
+        prefix = prefix.lower()
+        words = []
+        
+        for row in self.c:
+            if row[0].lower().startswith(prefix):
+                words.append(Word(*row))
+        
+        return words
+    
+    def search_words(self, query, difficulty=None, limit=SEARCH_LIMIT,
+                     ranked=True):
+        '''Find the words whose word, definition or example match a query.
+        Each term of the query matches any word starting with it, and terms
+        in double quotes must appear together as a phrase.
+        
+        Arguments:
+        query -- The text to search for.
+        difficulty -- Only find words of this difficulty (optional).
+        limit -- The greatest number of words to return, or None for all.
+        ranked -- If False, the words are returned in no particular order.
+        Ranking has to score every match before the first can be returned, so
+        a short term matching much of the table takes over 100ms with ranking
+        and under a millisecond without it, when the results are limited.
+        
+        Returns:
+        A list of matching Word objects, best matches first if ranked.
+        
+        '''
+        terms = SEARCH_TERM.findall(query)
+        
+        if not terms:
+            return []
+        
+        if self._has_search_index():
+            # Quote every term so that characters with a meaning in the FTS5
+            # query syntax are searched for literally.
+            match = []
+            for phrase, term in terms:
+                if phrase:
+                    match.append('"%s"' % phrase.replace('"', '""'))
+                else:
+                    match.append('"%s"*' % term.replace('"', '""'))
+            
+            sql = ('SELECT words.string, words.definition, words.example, '
+                   'words.difficulty FROM words_fts JOIN words '
+                   'ON words.id = words_fts.rowid WHERE words_fts MATCH ? ')
+            parameters = [' '.join(match)]
+            # Rank matches on the word itself above matches in the definition
+            # or example.
+            order = ranked and 'ORDER BY bm25(words_fts, 10.0, 1.0, 1.0) ' or ''
+            # The unary plus stops SQLite reading every word of the difficulty
+            # through its index and matching each one against the query, which
+            # is hundreds of times slower than filtering the matches.
+            difficulty_column = '+words.difficulty'
+        else:
+            # Without an index, scan the table for words starting with each
+            # term or definitions and examples containing it.
+            sql = SELECT_WORDS + 'WHERE 1 '
+            parameters = []
+            order = ''
+            difficulty_column = 'difficulty'
+            
+            for phrase, term in terms:
+                text = phrase or term
+                sql += 'AND (string LIKE ? OR definition LIKE ? OR example LIKE ?) '
+                parameters += [text + '%', '%' + text + '%', '%' + text + '%']
+        
+        if difficulty:
+            sql += 'AND %s=? ' % difficulty_column
+            parameters.append(difficulty)
+        
+        self._execute(sql + order + 'LIMIT ?', parameters + [limit or -1])
+        
+        words = []
+        
+        for row in self.c:
+            words.append(Word(*row))
+        
+        return words
+    
+    def _has_search_index(self):
+        '''Return whether the full text index exists. It is missing if SQLite
+        was built without FTS5.'''
+        try:
+            return self.search_index
+        except AttributeError:
+            self._execute("SELECT COUNT(*) FROM sqlite_master WHERE name='words_fts'")
+            self.search_index = bool(self.c.fetchone()[0])
+            return self.search_index
    
     def _remove_word(self, word):
         '''Remove a given word from the database.
@@ -293,18 +1116,247 @@ class _WordManager(_DBManager):
         
         '''
         try:
-            self.c.execute('DELETE FROM words WHERE string=?', (word.word,))
+            string = word.word
         except AttributeError:
-            self.c.execute('DELETE FROM words WHERE string=?', (word,))
+            string = word
+            
+        self._execute('DELETE FROM words WHERE string=?', (string,))
+        self._execute('DELETE FROM list_words WHERE word=?', (string,))
+        self.cache.invalidate(string)
 
-# Keep track of the instances of the database managers.
-uminstance = _UserManager()
-wminstance = _WordManager()
+class _ListManager(_DBManager):
+    '''A singleton to manage word lists in the database. A list only records
+    which words are in it, and the words themselves are kept in the words
+    table, so a list is read by joining the two.
+    
+    Public functions:
+    save_list -- Add a list to the database, or replace the one of that name.
+    add_list_words -- Add words to a list.
+    remove_list_words -- Remove words from a list.
+    retrieve_list -- Find and return a WordList.
+    retrieve_list_names -- Find and return a list of the names of all lists.
+    list_summaries -- Find the source, date edited and size of every list.
+    remove_list -- Remove a list from the database.
+    
+    '''
+    def save_list(self, wordlist):
+        '''Add a list to the database, replacing the source, date edited and
+        words of any list with the same name. Words which aren't in the words
+        table are added to it, while those which are keep the definition and
+        example already stored.
+        
+        Arguments:
+        wordlist -- The WordList to save.
+        
+        '''
+        self._execute('INSERT OR IGNORE INTO lists (name) VALUES (?)',
+                      (wordlist.name,))
+        self._execute('UPDATE lists SET source=?, date_edited=? WHERE name=?',
+                      (wordlist.source, wordlist.date_edited, wordlist.name))
+        
+        list_id = self._list_id(wordlist.name)
+        self._execute('DELETE FROM list_words WHERE list_id=?', (list_id,))
+        self._add_members(list_id, wordlist.words.itervalues())
+        
+    def add_list_words(self, listname, words):
+        '''Add words to a list.
+        
+        Arguments:
+        listname -- The name of the list.
+        words -- An iterable of Word objects.
+        
+        Returns:
+        False if there is no list of that name, otherwise True.
+        
+        '''
+        list_id = self._list_id(listname)
+        
+        if list_id is None:
+            return False
+        
+        self._add_members(list_id, words)
+        return True
+    
+    def remove_list_words(self, listname, words):
+        '''Remove words from a list. The words stay in the words table.
+        
+        Arguments:
+        listname -- The name of the list.
+        words -- An iterable of strings or Word objects.
+        
+        '''
+        list_id = self._list_id(listname)
+        
+        for batch in _batches(words, BATCH_SIZE):
+            self._executemany('DELETE FROM list_words WHERE list_id=? AND word=?',
+                              [(list_id, getattr(word, 'word', word))
+                               for word in batch])
+            
+    def retrieve_list(self, listname):
+        '''Retrieve a list from the database.
+        
+        Arguments:
+        listname -- The name of the list.
+        
+        Returns:
+        A WordList holding the words of the list, or None if there is no list
+        of that name.
+        
+        '''
+        self._execute('SELECT id, source, date_edited FROM lists WHERE name=?',
+                      (listname,))
+        row = self.c.fetchone()
+        
+        if row is None:
+            return None
+        
+        wordlist = WordList(listname, row[1] or '', row[2] or '')
+        
+        # Both sides of the join are found through their primary keys.
+        self._execute('SELECT words.string, words.definition, words.example, '
+                      'words.difficulty FROM list_words JOIN words '
+                      'ON words.string = list_words.word WHERE list_words.list_id=?',
+                      (row[0],))
+        
+        for word in self.c:
+            wordlist._add_word(Word(*word))
+            
+        return wordlist
+    
+    def retrieve_list_names(self):
+        '''Retrieve the names of all lists in the database.
+        
+        Returns:
+        The sorted list of the names.
+        
+        '''
+        self._execute('SELECT name FROM lists ORDER BY name')
+        return [row[0] for row in self.c]
+    
+    def list_summaries(self):
+        '''Find the source, date edited and number of words of every list,
+        without reading the words.
+        
+        Returns:
+        Dictionary where the keys are the names of the lists and the values
+        are dictionaries of the 'source', 'date_edited' and 'count', as
+        returned by tools.tldr.scan_tldr_headers.
+        
+        '''
+        self._execute('SELECT name, source, date_edited, COUNT(list_words.word) '
+                      'FROM lists LEFT JOIN list_words ON list_words.list_id = lists.id '
+                      'GROUP BY lists.id')
+        
+        return dict((row[0], {'source': row[1] or '', 'date_edited': row[2] or '',
+                              'count': row[3]}) for row in self.c)
+    
+    def remove_list(self, listname):
+        '''Remove a list from the database. Its words stay in the words
+        table.
+        
+        Arguments:
+        listname -- The name of the list.
+        
+        '''
+        list_id = self._list_id(listname)
+        self._execute('DELETE FROM list_words WHERE list_id=?', (list_id,))
+        self._execute('DELETE FROM lists WHERE id=?', (list_id,))
+        
+    def _list_id(self, listname):
+        '''Return the id of a list, or None if there is no list of that
+        name.'''
+        self._execute('SELECT id FROM lists WHERE name=?', (listname,))
+        row = self.c.fetchone()
+        return row and row[0]
+    
+    def _add_members(self, list_id, words):
+        '''Add words to the words table if they aren't there, and make them
+        members of a list.'''
+        added = 0
+        
+        for batch in _batches(words, BATCH_SIZE):
+            self._executemany('INSERT OR IGNORE ' + INSERT_WORD,
+                              [(word.word, word.definition, word.example,
+                                word.difficulty.strip()) for word in batch])
+            added += self.c.rowcount
+            self._executemany('INSERT OR IGNORE INTO list_words VALUES (?, ?)',
+                              [(list_id, word.word) for word in batch])
+        
+        # The word manager may have cached the new words as missing.
+        if added:
+            get_word_manager().cache.clear()
+
+def _batches(iterable, size):
+    '''Yield lists of up to size items from an iterable.'''
+    iterator = iter(iterable)
+    
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        
+        if not batch:
+            return
+        
+        yield batch
+
+# The connection provider and database managers are only created when they are
+# first asked for, so that importing this module doesn't touch the database.
+# The managers all share the one provider.
+provider = None
+uminstance = None
+wminstance = None
+lminstance = None
+lock = threading.RLock()
+
+# Seconds spent setting up the database, keyed by the step.
+timings = {}
+
+def _add_timing(step, seconds):
+    '''Add to the time spent on a step of setting up the database.'''
+    timings[step] = timings.get(step, 0.0) + seconds
+
+def get_provider():
+    '''Return the connection provider shared by the database managers.'''
+    global provider
+    
+    with lock:
+        if provider is None:
+            provider = _ConnectionProvider(profiler=profiling.from_environment())
+        
+    return provider
+
+def query_summary():
+    '''Return the timings of each statement run on the database, as given by
+    tools.profiler.QueryProfiler.summary, or None if profiling is turned off
+    (see tools/profiler.py).'''
+    return get_provider().profiler and get_provider().profiler.summary()
 
 def get_user_manager():
     '''Return the user manager instance.'''
+    global uminstance
+    
+    with lock:
+        if uminstance is None:
+            uminstance = _UserManager(get_provider(), USER_CACHE_SIZE)
+        
     return uminstance
 
 def get_word_manager():
     '''Return the word manager instance.'''
+    global wminstance
+    
+    with lock:
+        if wminstance is None:
+            wminstance = _WordManager(get_provider(), WORD_CACHE_SIZE)
+        
     return wminstance
+
+def get_list_manager():
+    '''Return the list manager instance.'''
+    global lminstance
+    
+    with lock:
+        if lminstance is None:
+            # Lists are mutable, so they aren't cached.
+            lminstance = _ListManager(get_provider(), 0)
+        
+    return lminstance
\ No newline at end of file
@@ -0,0 +1,248 @@
+'''
+Module to read tldr files without parsing them up front.
+
+A tldr file is memory mapped, and an index of the offset of each word's line,
+sorted by word, is either loaded from the index file beside it (the list's path
+with '.idx' added) or built by scanning the file once and then saved there. A
+word is only decoded when it is looked up, which is found by a binary search of
+the index, so opening even a very large list takes little time or memory.
+
+The list's change log (see tools/tldr.py) is applied on top of the mapped file.
+
+Exported classes:
+
+MappedWords -- A read only mapping of the words in a memory mapped tldr file.
+
+Exported functions:
+
+open_tldr -- Open a tldr file as a WordList of MappedWords.
+
+'''
+from array import array
+from collections import Mapping
+import mmap
+import os
+import struct
+import tools.tldr as tldr
+from aid.words import Word, WordList, split_fields
+
+# The index file starts with MAGIC and then the modification time, size and
+# inode of the tldr file it was built from, the size of each offset and the
+# number of offsets, followed by the offsets themselves. The last byte of
+# MAGIC is the version of this layout.
+MAGIC = 'TLDRIDX' + chr(2)
+HEADER = struct.Struct('>dQQBQ')
+
+class MappedWords(Mapping):
+    '''A read only mapping of the words in a memory mapped tldr file to Word
+    objects. Each lookup decodes a new Word from the file.'''
+    def __init__(self, data, offsets, changes=None):
+        '''Create the mapping.
+
+        Arguments:
+        data -- The mapped file, or any string holding it.
+        offsets -- An array of the offsets of the lines of the words in the
+        file, sorted by word with no word repeated.
+        changes -- A dictionary of words changed by the list's change log,
+        where each value is the new Word or None if it was removed (optional).
+
+        '''
+        self.data = data
+        self.offsets = offsets
+        self.changes = changes or {}
+
+        # The changed words that are also in the file are counted once.
+        self.length = len(offsets)
+
+        for word, value in self.changes.iteritems():
+            self.length += (value is not None) - (self._find(word) is not None)
+
+    def __getitem__(self, word):
+        if word in self.changes:
+            value = self.changes[word]
+
+            if value is None:
+                raise KeyError(word)
+
+            return value
+
+        offset = self._find(word)
+
+        if offset is None:
+            raise KeyError(word)
+
+        end = self.data.find('\n', offset)
+        return Word.deserialise(self.data[offset:end if end >= 0 else len(self.data)])
+
+    def __contains__(self, word):
+        if word in self.changes:
+            return self.changes[word] is not None
+
+        return self._find(word) is not None
+
+    def __iter__(self):
+        for offset in self.offsets:
+            word = _key_at(self.data, offset)
+
+            if word not in self.changes:
+                yield word
+
+        for word, value in self.changes.iteritems():
+            if value is not None:
+                yield word
+
+    def __len__(self):
+        return self.length
+
+    def _find(self, word):
+        '''Return the offset of the line of a word in the file, or None if it
+        isn't there.'''
+        data = self.data
+        offsets = self.offsets
+        low, high = 0, len(offsets)
+
+        while low < high:
+            middle = (low + high) // 2
+
+            if _key_at(data, offsets[middle]) < word:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < len(offsets) and _key_at(data, offsets[low]) == word:
+            return offsets[low]
+
+        return None
+
+def _key_at(data, offset):
+    '''Return the word on the line starting at an offset.'''
+    end = data.find('\n', offset)
+
+    if end < 0:
+        end = len(data)
+
+    bar = data.find('|', offset, end)
+
+    if bar < 0 or data.find('\\', offset, bar) >= 0:
+        # A line holding only a word, or a word holding an escaped character
+        # whose separator may be further along the line.
+        return split_fields(data[offset:end].rstrip('\r'))[0]
+
+    return data[offset:bar]
+
+def _build_index(data):
+    '''Return an array of the offsets of the lines of the words in a tldr
+    file, sorted by word. Where a word appears more than once, the last line
+    is kept, as it is when the file is parsed.'''
+    lines = []
+    offset = 0
+
+    while offset < len(data):
+        end = data.find('\n', offset)
+
+        if end < 0:
+            end = len(data)
+
+        # Skip comment lines and lines too short to be words, in the same way
+        # as tools.tldr.iter_tldr, which counts the new line character.
+        if data[offset] != '#' and end + 1 - offset > 3:
+            lines.append((_key_at(data, offset), offset))
+
+        offset = end + 1
+
+    lines.sort()
+    offsets = array('L')
+
+    for i, (word, offset) in enumerate(lines):
+        if i + 1 == len(lines) or lines[i + 1][0] != word:
+            offsets.append(offset)
+
+    return offsets
+
+def _index_path(tldrfile):
+    '''Return the path of the index file of a tldr file.'''
+    return tldrfile + '.idx'
+
+def _load_index(tldrfile, key):
+    '''Return the offsets saved in the index file of a tldr file, or None if
+    there isn't one for this version of the file.'''
+    try:
+        with open(_index_path(tldrfile), 'rb') as f:
+            data = f.read()
+    except IOError:
+        return None
+
+    start = len(MAGIC) + HEADER.size
+
+    if not data.startswith(MAGIC) or len(data) < start:
+        return None
+
+    header = HEADER.unpack_from(data, len(MAGIC))
+    offsets = array('L')
+
+    if header[:3] != key or header[3] != offsets.itemsize:
+        return None
+
+    if len(data) - start != header[4] * offsets.itemsize:
+        return None
+
+    offsets.fromstring(data[start:])
+    return offsets
+
+def _save_index(tldrfile, key, offsets):
+    '''Save the offsets to the index file of a tldr file. The index is only a
+    shortcut, so nothing is done if it can't be written.'''
+    temp = _index_path(tldrfile) + '.tmp'
+
+    try:
+        with open(temp, 'wb') as f:
+            f.write(MAGIC)
+            f.write(HEADER.pack(*(key + (offsets.itemsize, len(offsets)))))
+            f.write(offsets.tostring())
+
+        os.rename(temp, _index_path(tldrfile))
+    except (IOError, OSError):
+        pass
+
+def open_tldr(tldrfile, listname='default'):
+    '''Open a tldr file as a WordList whose words are read from the file only
+    when they are looked up. The file stays mapped while the WordList is in
+    use, and the WordList can't be changed.
+
+    Arguments:
+    tldrfile -- The tldr file to read from
+    listname -- The name of the word list
+
+    Returns:
+    A WordList of MappedWords.
+
+    '''
+    with open(tldrfile, 'rb') as f:
+        stat = os.fstat(f.fileno())
+
+        # An empty file can't be mapped.
+        if stat.st_size:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            data = ''
+
+    key = (stat.st_mtime, stat.st_size, stat.st_ino)
+    offsets = _load_index(tldrfile, key)
+
+    if offsets is None:
+        offsets = _build_index(data)
+        _save_index(tldrfile, key, offsets)
+
+    # The header is the first few lines, so reading it again is cheap.
+    words = tldr.iter_tldr_file(tldrfile)
+    header = next(words)
+    words.close()
+
+    log = tldr.read_log(tldrfile, header['date_edited'])
+    changes = None
+
+    if log is not None:
+        header['date_edited'], header['count'], changes = log[:3]
+
+    return WordList(listname, header['source'], header['date_edited'],
+                    MappedWords(data, offsets, changes))
@@ -0,0 +1,399 @@
+'''
+Create and upgrade the tables of the Spellathon database.
+
+The version of the schema a database file is using is kept in PRAGMA
+user_version. A new database is created with the original schema and then
+brought up to date by the same migrations that upgrade an old database, so
+there is only one description of each version of the schema.
+
+Exported functions:
+
+migrate -- Bring a database up to the latest version of the schema.
+print_report -- Write migration progress to stderr.
+create_search_triggers -- Keep the full text index up to date with the words.
+drop_search_triggers -- Stop keeping the full text index up to date.
+
+'''
+import sqlite3 as sqlite
+import pickle
+import re
+import sys
+import time
+from aid.words import Word
+
+# Number of rows read and written at a time while converting a table, so that
+# large tables never have to be held in memory all at once.
+BATCH_SIZE = 2000
+
+'''The original schema. The primary key of a word record is the word itself,
+associated with a serialised Word which contains the related metadata. The
+primary key of a user record is the username, associated with a serialised User
+which also carries every score the user has achieved.
+'''
+LEGACY = '''
+CREATE TABLE 'words' (
+    'string' VARCHAR(96) PRIMARY KEY,
+    'word' Word
+);
+
+CREATE TABLE 'users' (
+    'username' VARCHAR(96) PRIMARY KEY,
+    'user' User
+);
+'''
+
+def _execute_script(db, script):
+    '''Run each statement of a script. Connection.executescript can't be used
+    because it commits the transaction that the migration is running in.'''
+    # Statements are separated by a semicolon and a blank line, so that the
+    # statements inside a trigger are kept together.
+    for statement in re.split(r';\s*\n\s*\n', script):
+        if statement.strip():
+            db.execute(statement)
+
+def _columns(db, table):
+    '''Return the names of the columns of a table.'''
+    return [row[1] for row in db.execute("PRAGMA table_info('%s')" % table)]
+
+def _tables(db):
+    '''Return the names of the tables in the database.'''
+    return [row[0] for row in
+            db.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+
+def _convert(db, select, insert, convert, report):
+    '''Stream the rows of a select statement through a conversion function
+    into an insert statement in batches.
+
+    Arguments:
+    db -- The connection to the database.
+    select -- The statement that reads the old rows.
+    insert -- The statement that writes the new rows.
+    convert -- Function taking an old row and returning a list of new rows.
+    report -- Function called with the number of rows converted so far.
+
+    '''
+    cursor = db.cursor()
+    cursor.execute(select)
+    done = 0
+
+    while True:
+        rows = cursor.fetchmany(BATCH_SIZE)
+
+        if not rows:
+            break
+
+        new = []
+        for row in rows:
+            new.extend(convert(row))
+
+        db.executemany(insert, new)
+        done += len(rows)
+        report(done)
+
+def _words_columns(db, report):
+    '''Store the definition, example and difficulty of each word in their own
+    columns, with an index on difficulty.'''
+    # Databases opened by older versions of Spellathon may already have been
+    # converted without recording it in user_version.
+    if 'word' not in _columns(db, 'words'):
+        return
+
+    db.execute('ALTER TABLE words RENAME TO legacy_words')
+    _execute_script(db, '''
+    CREATE TABLE 'words' (
+        'string' VARCHAR(96) PRIMARY KEY,
+        'definition' TEXT,
+        'example' TEXT,
+        'difficulty' VARCHAR(8)
+    );
+
+    CREATE INDEX 'words_difficulty' ON 'words' ('difficulty');
+    ''')
+
+    def convert(row):
+        word = Word.deserialise(row[0])
+        return [(word.word, word.definition, word.example,
+                 word.difficulty.strip())]
+
+    # Casting the column stops the registered Word converter (if any) being
+    # applied, so the text can be decoded here.
+    _convert(db, 'SELECT CAST(word AS TEXT) FROM legacy_words',
+             'INSERT INTO words VALUES (?, ?, ?, ?)', convert, report)
+
+    db.execute('DROP TABLE legacy_words')
+
+def _scores_table(db, report):
+    '''Move the scores pickled into each user record into a scores table with
+    one row per play.'''
+    if 'scores' in _tables(db):
+        return
+
+    _execute_script(db, '''
+    CREATE TABLE 'scores' (
+        'username' VARCHAR(96),
+        'list' VARCHAR(96),
+        'score' INTEGER,
+        'played_at' TIMESTAMP
+    );
+
+    CREATE INDEX 'scores_username_list' ON 'scores' ('username', 'list');
+    ''')
+
+    db.execute('ALTER TABLE users RENAME TO legacy_users')
+    db.execute('''CREATE TABLE 'users' (
+        'username' VARCHAR(96) PRIMARY KEY,
+        'user' User
+    )''')
+
+    def convert(row):
+        # Split the record rather than building a User, which would copy the
+        # user photo. The last part is the pickled dictionary of scores.
+        parts = row[0].split('|')
+
+        if len(parts) > 5:
+            for list, scores in pickle.loads(parts[5]).iteritems():
+                db.executemany('INSERT INTO scores VALUES (?, ?, ?, NULL)',
+                               [(parts[0], list, score) for score in scores])
+
+        # The user record is returned to be written without the scores.
+        return [(parts[0], '|'.join(parts[:5]))]
+
+    _convert(db, 'SELECT CAST(user AS TEXT) FROM legacy_users',
+             'INSERT INTO users VALUES (?, ?)', convert, report)
+
+    db.execute('DROP TABLE legacy_users')
+
+def _users_columns(db, report):
+    '''Store the details of each user in their own columns.'''
+    db.execute('ALTER TABLE users RENAME TO legacy_users')
+    db.execute('''CREATE TABLE 'users' (
+        'username' VARCHAR(96) PRIMARY KEY,
+        'realname' TEXT,
+        'password' VARCHAR(64),
+        'dob' VARCHAR(16),
+        'photo' TEXT
+    )''')
+
+    def convert(row):
+        return [tuple(row[0].split('|')[:5])]
+
+    _convert(db, 'SELECT CAST(user AS TEXT) FROM legacy_users',
+             'INSERT INTO users VALUES (?, ?, ?, ?, ?)', convert, report)
+
+    db.execute('DROP TABLE legacy_users')
+
+# The triggers which keep the full text index up to date with the words table,
+# once the words table has its own id column (migration 6).
+SEARCH_TRIGGERS = '''
+CREATE TRIGGER 'words_fts_insert' AFTER INSERT ON 'words' BEGIN
+    INSERT INTO words_fts(rowid, string, definition, example)
+    VALUES (new.id, new.string, new.definition, new.example);
+END;
+
+CREATE TRIGGER 'words_fts_delete' AFTER DELETE ON 'words' BEGIN
+    INSERT INTO words_fts(words_fts, rowid, string, definition, example)
+    VALUES ('delete', old.id, old.string, old.definition, old.example);
+END;
+
+CREATE TRIGGER 'words_fts_update' AFTER UPDATE ON 'words' BEGIN
+    INSERT INTO words_fts(words_fts, rowid, string, definition, example)
+    VALUES ('delete', old.id, old.string, old.definition, old.example);
+    INSERT INTO words_fts(rowid, string, definition, example)
+    VALUES (new.id, new.string, new.definition, new.example);
+END;
+'''
+
+def create_search_triggers(db):
+    '''Create the triggers which keep the full text index up to date with the
+    words table.'''
+    _execute_script(db, SEARCH_TRIGGERS)
+
+def drop_search_triggers(db):
+    '''Drop the triggers which keep the full text index up to date, so that a
+    large number of words can be written without updating the index for each
+    one. The index must be rebuilt and the triggers created again afterwards,
+    in the same transaction.'''
+    for name in re.findall(r"CREATE TRIGGER '(\w+)'", SEARCH_TRIGGERS):
+        db.execute("DROP TRIGGER IF EXISTS '%s'" % name)
+
+def _words_search(db, report):
+    '''Add a full text index over the word, definition and example of each
+    word, kept up to date by triggers on the words table. The index uses the
+    words table as its content rather than storing a second copy of the text.
+    Nothing is done if SQLite was built without FTS5, and searches fall back to
+    scanning the words table.'''
+    try:
+        db.execute('''CREATE VIRTUAL TABLE 'words_fts' USING fts5(
+            string, definition, example, content='words', content_rowid='rowid'
+        )''')
+    except sqlite.OperationalError:
+        return
+
+    _execute_script(db, '''
+    CREATE TRIGGER 'words_fts_insert' AFTER INSERT ON 'words' BEGIN
+        INSERT INTO words_fts(rowid, string, definition, example)
+        VALUES (new.rowid, new.string, new.definition, new.example);
+    END;
+
+    CREATE TRIGGER 'words_fts_delete' AFTER DELETE ON 'words' BEGIN
+        INSERT INTO words_fts(words_fts, rowid, string, definition, example)
+        VALUES ('delete', old.rowid, old.string, old.definition, old.example);
+    END;
+
+    CREATE TRIGGER 'words_fts_update' AFTER UPDATE ON 'words' BEGIN
+        INSERT INTO words_fts(words_fts, rowid, string, definition, example)
+        VALUES ('delete', old.rowid, old.string, old.definition, old.example);
+        INSERT INTO words_fts(rowid, string, definition, example)
+        VALUES (new.rowid, new.string, new.definition, new.example);
+    END;
+    ''')
+
+    # Index the words that are already in the table.
+    db.execute("INSERT INTO words_fts(words_fts) VALUES ('rebuild')")
+
+def _words_key(db, report):
+    '''Give the words table an INTEGER PRIMARY KEY for the full text index to
+    refer to. The index used the implicit rowid, which VACUUM may renumber for
+    a table whose primary key isn't an integer, leaving the index pointing at
+    the wrong words. The index is also given prefix indexes, so that searches
+    for the first few letters of a word don't have to scan every term.'''
+    search = 'words_fts' in _tables(db)
+
+    if search:
+        db.execute('DROP TABLE words_fts')
+
+    _execute_script(db, '''
+    CREATE TABLE 'new_words' (
+        'id' INTEGER PRIMARY KEY,
+        'string' VARCHAR(96) UNIQUE,
+        'definition' TEXT,
+        'example' TEXT,
+        'difficulty' VARCHAR(8)
+    );
+
+    INSERT INTO new_words (id, string, definition, example, difficulty)
+    SELECT rowid, string, definition, example, difficulty FROM words;
+
+    DROP TABLE words;
+
+    ALTER TABLE new_words RENAME TO words;
+
+    CREATE INDEX 'words_difficulty' ON 'words' ('difficulty');
+    ''')
+    report(db.execute('SELECT COUNT(*) FROM words').fetchone()[0])
+
+    if search:
+        db.execute('''CREATE VIRTUAL TABLE 'words_fts' USING fts5(
+            string, definition, example, content='words', content_rowid='id',
+            prefix='1 2 3'
+        )''')
+        create_search_triggers(db)
+        db.execute("INSERT INTO words_fts(words_fts) VALUES ('rebuild')")
+
+def _lists_tables(db, report):
+    '''Add tables to keep word lists in the database. A list is a row of the
+    lists table, and its words are rows of the list_words table naming words
+    in the words table, so the definition and example of a word are stored
+    once however many lists it is in.'''
+    _execute_script(db, '''
+    CREATE TABLE 'lists' (
+        'id' INTEGER PRIMARY KEY,
+        'name' VARCHAR(96) UNIQUE,
+        'source' TEXT,
+        'date_edited' VARCHAR(32)
+    );
+
+    CREATE TABLE 'list_words' (
+        'list_id' INTEGER REFERENCES lists(id),
+        'word' VARCHAR(96) REFERENCES words(string),
+        PRIMARY KEY ('list_id', 'word')
+    );
+
+    CREATE INDEX 'list_words_word' ON 'list_words' ('word');
+    ''')
+
+'''Each migration upgrades the database from the previous version to the
+version it is numbered with, and is given the table whose rows it streams so
+that progress can be reported.
+'''
+MIGRATIONS = [
+    (1, 'Store words in columns', 'words', _words_columns),
+    (2, 'Move scores into the scores table', 'users', _scores_table),
+    (3, 'Store users in columns', 'users', _users_columns),
+    (4, 'Index words for full text search', 'words', _words_search),
+    (5, 'Add tables for word lists', 'words', _lists_tables),
+    (6, 'Give words an integer key', 'words', _words_key),
+]
+
+VERSION = MIGRATIONS[-1][0]
+
+def print_report(message):
+    '''Write migration progress to stderr.'''
+    sys.stderr.write(message + '\n')
+
+def migrate(db, report=print_report):
+    '''Bring a database up to the latest version of the schema. All of the
+    migrations needed are run in a single transaction, so a failure leaves the
+    database as it was.
+
+    Arguments:
+    db -- The connection to the database.
+    report -- Function called with messages describing the progress and timing
+    of each migration.
+
+    Returns:
+    A list of (version, description, seconds) tuples for the migrations run.
+
+    '''
+    version = db.execute('PRAGMA user_version').fetchone()[0]
+
+    if version >= VERSION:
+        return []
+
+    timings = []
+
+    # Control the transaction by hand, as the sqlite3 module would otherwise
+    # commit before each CREATE, ALTER and DROP statement.
+    isolation_level = db.isolation_level
+    db.isolation_level = None
+
+    # Begin before the try below, so that failing to get the lock raises the
+    # lock error rather than one from rolling back a transaction that never
+    # began.
+    try:
+        db.execute('BEGIN IMMEDIATE')
+    except:
+        db.isolation_level = isolation_level
+        raise
+
+    try:
+        # Another connection may have upgraded the database while this one
+        # was waiting for the lock.
+        version = db.execute('PRAGMA user_version').fetchone()[0]
+
+        if not _tables(db):
+            _execute_script(db, LEGACY)
+
+        for number, description, table, migration in MIGRATIONS:
+            if number <= version:
+                continue
+
+            start = time.time()
+            total = db.execute('SELECT COUNT(*) FROM ' + table).fetchone()[0]
+            report('Migration %d: %s (%d rows)' % (number, description, total))
+
+            migration(db, lambda done: report('  %d/%d rows' % (done, total)))
+
+            seconds = time.time() - start
+            timings.append((number, description, seconds))
+            report('Migration %d finished in %.2fs' % (number, seconds))
+
+        db.execute('PRAGMA user_version = %d' % VERSION)
+        db.execute('COMMIT')
+    except:
+        db.execute('ROLLBACK')
+        raise
+    finally:
+        db.isolation_level = isolation_level
+
+    return timings
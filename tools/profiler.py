@@ -0,0 +1,338 @@
+'''
+Module to time the statements run on the Spellathon database.
+
+Profiling is turned on by setting the SPELLATHON_DB_PROFILE environment
+variable. Statements taking longer than SPELLATHON_SLOW_QUERY_MS milliseconds
+(default 100) are written to the file named by SPELLATHON_SLOW_QUERY_LOG
+(default slowqueries.log), and a summary of every statement is added to the
+same file when Spellathon exits.
+
+Exported classes:
+
+QueryProfiler -- Collects the timings of database statements.
+ProfiledConnection -- A connection which reports each statement, commit and
+rollback to a QueryProfiler.
+ProfiledCursor -- A cursor which reports each statement to a QueryProfiler.
+
+Exported functions:
+
+from_environment -- Create a QueryProfiler if profiling is turned on.
+
+'''
+from collections import deque
+import sqlite3 as sqlite
+import atexit
+import datetime
+import os
+import re
+import sys
+import threading
+import time
+
+# Number of recent timings kept for each statement to work out percentiles.
+SAMPLES = 1000
+
+# Functions which run statements on behalf of their caller. The caller is
+# reported as the first function up the stack that isn't one of these.
+PLUMBING = set(['execute', 'executemany', 'executescript', 'fetchone',
+                'fetchmany', 'fetchall', 'next', '__iter__', 'commit',
+                'rollback', 'retry', '_execute', '_executemany', '_iter_rows',
+                '_finish', '_run', '_time'])
+
+WHITESPACE = re.compile(r'\s+')
+
+class QueryProfiler(object):
+    '''Collects the timings of database statements and logs slow ones.
+
+    Public functions:
+    record -- Record one run of a statement.
+    summary -- Return the counts and percentile timings of each statement.
+    report -- Return the summary as text.
+    write_summary -- Add the report to the slow query log.
+
+    '''
+    def __init__(self, threshold=0.1, log='slowqueries.log'):
+        '''Create the profiler.
+
+        Arguments:
+        threshold -- Seconds after which a statement is logged as slow.
+        log -- The path of the slow query log.
+
+        '''
+        self.threshold = threshold
+        self.log = log
+        self.statements = {}
+        self.lock = threading.Lock()
+
+    def record(self, sql, rows, seconds, caller):
+        '''Record one run of a statement.
+
+        Arguments:
+        sql -- The text of the statement.
+        rows -- The number of rows read or changed.
+        seconds -- The wall time taken by the statement.
+        caller -- The name of the function that ran the statement.
+
+        '''
+        sql = WHITESPACE.sub(' ', sql).strip()
+
+        with self.lock:
+            try:
+                stats = self.statements[sql]
+            except KeyError:
+                stats = self.statements[sql] = {'count': 0, 'rows': 0,
+                                                'seconds': 0.0,
+                                                'callers': set(),
+                                                'samples': deque(maxlen=SAMPLES)}
+
+            stats['count'] += 1
+            stats['rows'] += max(rows, 0)
+            stats['seconds'] += seconds
+            stats['callers'].add(caller)
+            stats['samples'].append(seconds)
+
+        if seconds >= self.threshold:
+            self._log('%s %8.1fms %6d rows %s: %s\n' %
+                      (datetime.datetime.now(), seconds * 1000, rows, caller, sql))
+
+    def summary(self):
+        '''Return a dictionary keyed by statement text, where each value is a
+        dictionary of the 'count', total 'rows' and 'seconds', the 'callers',
+        and the 'p50', 'p95' and 'p99' times in seconds of the statement.'''
+        summary = {}
+
+        with self.lock:
+            for sql, stats in self.statements.iteritems():
+                samples = sorted(stats['samples'])
+                summary[sql] = {'count': stats['count'],
+                                'rows': stats['rows'],
+                                'seconds': stats['seconds'],
+                                'callers': sorted(stats['callers']),
+                                'p50': _percentile(samples, 50),
+                                'p95': _percentile(samples, 95),
+                                'p99': _percentile(samples, 99)}
+
+        return summary
+
+    def report(self):
+        '''Return the summary as text, slowest total time first.'''
+        summary = self.summary()
+        lines = ['%7s %8s %9s %9s %9s  %s' % ('count', 'rows', 'p50 ms',
+                                              'p95 ms', 'p99 ms', 'statement')]
+
+        for sql in sorted(summary, key=lambda s: -summary[s]['seconds']):
+            stats = summary[sql]
+            lines.append('%7d %8d %9.2f %9.2f %9.2f  %s (%s)' %
+                         (stats['count'], stats['rows'], stats['p50'] * 1000,
+                          stats['p95'] * 1000, stats['p99'] * 1000, sql,
+                          ', '.join(stats['callers'])))
+
+        return '\n'.join(lines) + '\n'
+
+    def write_summary(self):
+        '''Add the report to the slow query log.'''
+        if self.statements:
+            self._log('Summary at %s\n%s' % (datetime.datetime.now(), self.report()))
+
+    def _log(self, text):
+        '''Append text to the slow query log.'''
+        try:
+            with open(self.log, 'a') as f:
+                f.write(text)
+        except IOError:
+            sys.stderr.write(text)
+
+class ProfiledConnection(sqlite.Connection):
+    '''A connection which reports each statement to a QueryProfiler, along
+    with its commits and rollbacks. Pass it as the factory of sqlite3.connect
+    and then set its profiler.
+
+    Statements run through the execute functions of the connection are
+    reported too, as sqlite3 runs them on a cursor made by the cursor function.
+
+    Public functions:
+    cursor -- Return a new ProfiledCursor.
+    commit -- Commit the current transaction.
+    rollback -- Roll back the current transaction.
+
+    '''
+    profiler = None
+
+    def cursor(self, factory=sqlite.Cursor):
+        '''Return a new cursor, which reports to the profiler if one is set.'''
+        cursor = sqlite.Connection.cursor(self, factory)
+
+        if self.profiler:
+            return ProfiledCursor(cursor, self.profiler)
+        else:
+            return cursor
+
+    def commit(self):
+        '''Commit the current transaction.'''
+        self._time(sqlite.Connection.commit, 'COMMIT')
+
+    def rollback(self):
+        '''Roll back the current transaction.'''
+        self._time(sqlite.Connection.rollback, 'ROLLBACK')
+
+    def _time(self, function, name):
+        '''Run a function of the connection, reporting it under a name.'''
+        start = time.time()
+        function(self)
+
+        if self.profiler:
+            self.profiler.record(name, 0, time.time() - start, _caller())
+
+class ProfiledCursor(object):
+    '''A cursor which reports each statement to a QueryProfiler. The time
+    spent fetching the rows of a query counts towards it, but the time the
+    caller spends between fetches doesn't. Iterating over the cursor fetches
+    all of the remaining rows at once, so that the time isn't taken by a call
+    for each row.
+
+    Public functions:
+    execute -- Execute a statement.
+    executemany -- Execute a statement for each set of parameters.
+    executescript -- Execute several statements.
+    fetchone -- Fetch the next row.
+    fetchmany -- Fetch the next rows.
+    fetchall -- Fetch the remaining rows.
+
+    '''
+    def __init__(self, cursor, profiler):
+        '''Create the cursor.
+
+        Arguments:
+        cursor -- The sqlite3 cursor to wrap.
+        profiler -- The QueryProfiler to report to.
+
+        '''
+        self.cursor = cursor
+        self.profiler = profiler
+        self.current = None
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    def execute(self, sql, parameters=()):
+        '''Execute a statement.'''
+        return self._run(self.cursor.execute, sql, parameters)
+
+    def executemany(self, sql, rows):
+        '''Execute a statement for each set of parameters.'''
+        return self._run(self.cursor.executemany, sql, rows)
+
+    def executescript(self, sql):
+        '''Execute several statements, after committing any transaction.'''
+        return self._run(self.cursor.executescript, sql)
+
+    def fetchone(self):
+        '''Fetch the next row, or None if there are no more.'''
+        start = time.time()
+        row = self.cursor.fetchone()
+        self._fetched(start, row is not None and 1 or 0, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        '''Fetch up to size rows.'''
+        size = size or self.cursor.arraysize
+        start = time.time()
+        rows = self.cursor.fetchmany(size)
+        self._fetched(start, len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        '''Fetch the remaining rows.'''
+        start = time.time()
+        rows = self.cursor.fetchall()
+        self._fetched(start, len(rows), True)
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __del__(self):
+        # Cursors made by the execute functions of a connection are often
+        # dropped before their last row is fetched.
+        self._finish()
+
+    def next(self):
+        row = self.fetchone()
+
+        if row is None:
+            raise StopIteration
+
+        return row
+
+    def _run(self, function, sql, *parameters):
+        '''Run a statement, keeping track of it until its rows are fetched.'''
+        self._finish()
+
+        start = time.time()
+        function(sql, *parameters)
+        self.current = {'sql': sql, 'seconds': time.time() - start,
+                        'rows': 0, 'caller': _caller()}
+
+        # Statements which don't return rows are finished straight away.
+        if self.cursor.description is None:
+            self.current['rows'] = self.cursor.rowcount
+            self._finish()
+
+        return self
+
+    def _fetched(self, start, rows, done):
+        '''Add a fetch to the statement being tracked.'''
+        if self.current:
+            self.current['seconds'] += time.time() - start
+            self.current['rows'] += rows
+
+            if done:
+                self._finish()
+
+    def _finish(self):
+        '''Report the statement being tracked to the profiler.'''
+        if self.current:
+            current, self.current = self.current, None
+            self.profiler.record(current['sql'], current['rows'],
+                                 current['seconds'], current['caller'])
+
+def _caller():
+    '''Return the name of the function which ran the current statement.'''
+    frame = sys._getframe(2)
+
+    while frame.f_back and frame.f_code.co_name in PLUMBING:
+        frame = frame.f_back
+
+    return frame.f_code.co_name
+
+def _percentile(samples, percent):
+    '''Return a percentile of a sorted list of samples.'''
+    if not samples:
+        return 0.0
+
+    index = int(round(percent / 100.0 * (len(samples) - 1)))
+    return samples[index]
+
+def from_environment():
+    '''Create a QueryProfiler if the SPELLATHON_DB_PROFILE environment
+    variable is set, and arrange for its summary to be logged at exit.
+
+    Returns:
+    The QueryProfiler, or None if profiling is turned off.
+
+    '''
+    if not os.environ.get('SPELLATHON_DB_PROFILE'):
+        return None
+
+    threshold = float(os.environ.get('SPELLATHON_SLOW_QUERY_MS', 100)) / 1000
+    log = os.environ.get('SPELLATHON_SLOW_QUERY_LOG', 'slowqueries.log')
+
+    profiler = QueryProfiler(threshold, log)
+    atexit.register(profiler.write_summary)
+
+    return profiler
@@ -2,106 +2,882 @@
 Module containing functions to generate and parse TLDR format files containing
 lists of words.
 
+Parsed lists are kept in a cache for the life of the process, and only files
+which have changed since they were last parsed are read again. Setting the
+SPELLATHON_TLDR_SNAPSHOT environment variable to a path also keeps the cache in
+that file between runs. Setting SPELLATHON_TLDR_WORKERS to a number of
+processes parses the files that have changed in parallel (0 uses one process
+per CPU).
+
+A tldr file is never rewritten in place. A new file is written beside it and
+renamed over it, so a crash while saving leaves either the old list or the new
+one. Small edits to a list are appended to a change log beside it (the list's
+path with '.log' added) rather than rewriting the whole list. The log is
+applied whenever the list is read, and is merged back into the list in the
+background once it grows past LOG_LIMIT bytes.
+
+Lists can also be kept in the database (see tools/database.py), with tldr files
+used to move them in and out through import_tldr and export_tldr.
+
 '''
-from aid.words import Word, WordList
+from aid.words import SortedWords, Word, WordList, WordTable, split_fields
 import datetime
 import glob
+import multiprocessing
 import os
+import struct
+import threading
+import tools.codec as codec
+import tools.database as database
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    # Python 2 only has concurrent.futures if the futures backport is
+    # installed, otherwise a multiprocessing pool is used.
+    ProcessPoolExecutor = None
+
+# Size of the buffer used to read tldr files a line at a time.
+BUFFER_SIZE = 64 * 1024
+
+# Size in bytes a change log can grow to before it is merged into its list.
+LOG_LIMIT = 64 * 1024
+
+# Saves which change at most this fraction of a list's words are appended to
+# its change log instead of rewriting the list.
+APPEND_RATIO = 0.1
+
+# Number of processes parse_tldr_files parses with by default.
+WORKERS = int(os.environ.get('SPELLATHON_TLDR_WORKERS', 1))
+
+# Held while a list or its change log is being written.
+write_lock = threading.RLock()
+
+# The tldr files whose change logs are being merged in the background.
+compacting = set()
+
+def iter_tldr(tldrfile):
+    '''Read a tldr file one line at a time, applying its change log.
+    
+    Arguments:
+    tldrfile -- The tldr file to read from
+    
+    Returns:
+    A generator which first yields a dictionary of the 'source', 'date_edited'
+    and word 'count' in the header of the file, then yields a Word for each
+    word in the file. Values missing from the header are given as '' (or None
+    for the count). The file is closed when the generator is exhausted or
+    closed, so callers can stop after as many words as they need.
+    
+    '''
+    words = iter_tldr_file(tldrfile)
+    
+    try:
+        header = next(words)
+        log = read_log(tldrfile, header['date_edited'])
+        
+        if log is None:
+            yield header
+            
+            for word in words:
+                yield word
+            
+            return
+        
+        # The log is small enough to hold in memory. The words it changes are
+        # skipped as the file is read, and their new versions yielded after.
+        header['date_edited'], header['count'], changes = log[:3]
+        yield header
+        
+        for word in words:
+            if word.word not in changes:
+                yield word
+        
+        for word in changes.itervalues():
+            if word is not None:
+                yield word
+    finally:
+        words.close()
+
+def iter_tldr_file(tldrfile):
+    '''Read a tldr file one line at a time, without its change log. Yields
+    the same as iter_tldr.'''
+    header = {'source': '', 'date_edited': '', 'count': None}
+    
+    with open(tldrfile, 'r', BUFFER_SIZE) as f:
+        lines = enumerate(f)
+        
+        # The metadata is in the comment lines at the top of the file: the
+        # source, the date edited and the number of words.
+        for i, line in lines:
+            if line[0] != '#':
+                break
+            
+            if i == 0:
+                header['source'] = line[1:].strip()
+            elif i == 1:
+                header['date_edited'] = line[1:].strip()
+            elif i == 2:
+                try:
+                    header['count'] = int(line[1:])
+                except ValueError:
+                    pass
+        else:
+            # The file has no words.
+            yield header
+            return
+        
+        yield header
+        
+        # The line which ended the header is the first word, unless it's too
+        # short to be one. Any later comment lines are skipped.
+        if len(line) > 3:
+            yield Word.deserialise(line)
+        
+        for i, line in lines:
+            if (line[0] != '#') and (len(line) > 3):
+                yield Word.deserialise(line)
 
-def parse_tldr(tldrfile, listname = 'default'):
+def parse_tldr(tldrfile, listname = 'default', compact=False):
     '''Gets each line from a tldr file and parses it into a WordList
     instance.
     
     Arguments:
     tldrfile -- The tldr file to read from
     listname -- The name of the word list to be generated from the tldr
+    compact -- If True, the words are kept in a WordTable instead of a
+    SortedWords, which uses far less memory but builds a new Word on every
+    lookup and doesn't keep the words in order.
             
     Returns:
     Returns the list of all words in the tldr file.
     
     '''
-    # Get the data from the file all at once. (Should probably change this to
-    # work line by line).
-    tldr = open(tldrfile)
-    data = tldr.readlines()
-    tldr.close()
+    words = iter_tldr(tldrfile)
+    header = next(words)
     
-    wordlist = WordList(listname)
+    wordlist = WordList(listname, header['source'], header['date_edited'],
+                        WordTable() if compact else None)
 
-    for i, line in enumerate(data):
-        # Take the first two lines of the filedata and parse them as metadata.
-        if line[0] == '#':
-            if i == 0:
-                wordlist.source = line[1:].strip()
-            if i == 1:
-                wordlist.date_edited = line[1:].strip()       
-        elif (line[0] != '#') and (len(line) > 3):
-        # All other lines which are not comment lines are words, so add the word
-        # to the wordlist.
-            word = Word.deserialise(line)
-            wordlist._add_word(word)
+    for word in words:
+        wordlist._add_word(word)
     
     return wordlist
 
-def parse_tldr_files(path):
-    '''Parse all tldr files in a given path.
+def read_word_records(wordfile):
+    '''Read the words in a pipe delimited file, such as a tldr file or the
+    output of tools/tldrfetcher.py, one line at a time.
+    
+    Arguments:
+    wordfile -- The path of the file to read from.
+    
+    Returns:
+    A generator of (word, definition, example, difficulty) tuples, suitable
+    for passing to _WordManager.add_words.
+    
+    '''
+    defaults = ('', 'no definition', 'no example', 'none')
+    
+    with open(wordfile) as f:
+        for line in f:
+            # Skip the metadata and any lines too short to be words, in the
+            # same way as parse_tldr.
+            if (line[0] != '#') and (len(line) > 3):
+                parts = split_fields(line.rstrip('\n'))
+                yield tuple(parts[:4]) + defaults[len(parts):]
+
+def scan_tldr_header(tldrfile):
+    '''Read the metadata of a tldr file without parsing its words.
+    
+    Arguments:
+    tldrfile -- The tldr file to read from
+    
+    Returns:
+    A dictionary of the 'source', 'date_edited' and word 'count' of the file.
+    Only the header lines are read, unless the file has no count in its header,
+    in which case its words are counted a line at a time.
+    
+    '''
+    words = iter_tldr(tldrfile)
+    header = next(words)
+    
+    if header['count'] is None:
+        header['count'] = sum(1 for word in words)
+    
+    words.close()
+    
+    return header
+
+def list_name(tldrfile):
+    '''Return the name of the list kept in a tldr file, which is the file's
+    name without the .tldr extension.'''
+    return os.path.splitext(os.path.basename(tldrfile))[0]
+
+def scan_tldr_headers(path):
+    '''Read the metadata of all tldr files in a given path.
     
     Arguments:
     path -- The path in which to look for tldr files.
     
+    Returns:
+    Dictionary containing the metadata of each list, as returned by
+    scan_tldr_header, where the keys are the names of the lists.
+    
+    '''
+    headers = {}
+    
+    for t in glob.glob(path + '*.tldr'):
+        try:
+            headers[list_name(t)] = scan_tldr_header(t)
+        except IOError:
+            # The file was removed after the directory was listed.
+            pass
+    
+    return headers
+
+class TLDRCache(object):
+    '''Cache of parsed tldr files. A file is parsed again only if its
+    modification time, size or inode have changed since it was cached.
+    
+    Public functions:
+    parse -- Return the WordList of a tldr file.
+    prune -- Forget files which are no longer in a directory.
+    save -- Write the cache to its snapshot file.
+    
+    '''
+    # The snapshot starts with MAGIC, then each file as its key from
+    # file_key and the length of its path, followed by the path and the
+    # encoded WordList. The last byte of MAGIC is the version of this layout.
+    MAGIC = 'TLDRSNAP' + chr(codec.VERSION) + chr(2)
+    ENTRY = struct.Struct('>dQQdQI')
+    
+    def __init__(self, snapshot=None):
+        '''Create the cache.
+        
+        Arguments:
+        snapshot -- The path of the file to keep the cache in between runs, or
+        None to keep it in memory only.
+        
+        '''
+        self.snapshot = snapshot
+        self.entries = {}
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.changed = False
+        
+    def parse(self, tldrfile, listname):
+        '''Return the WordList of a tldr file, parsing it only if it has
+        changed since it was cached.
+        
+        Arguments:
+        tldrfile -- The tldr file to read from
+        listname -- The name of the word list
+        
+        Returns:
+        A new WordList, which can be changed without affecting the cache. Its
+        words are kept in a WordTable.
+        
+        '''
+        try:
+            return self.parse_all([(tldrfile, listname)])[listname]
+        except KeyError:
+            raise IOError('No such file: ' + tldrfile)
+    
+    def parse_all(self, tldrfiles, workers=1):
+        '''Return the WordLists of many tldr files, parsing only those which
+        have changed since they were cached.
+        
+        Arguments:
+        tldrfiles -- A list of (tldrfile, listname) tuples.
+        workers -- The number of processes to parse the changed files with,
+        or 0 for one per CPU.
+        
+        Returns:
+        Dictionary containing a new WordList for each file, where the keys are
+        the names of the lists. Files which no longer exist are left out. The
+        words of each list are kept in a WordTable, as the cache may hold many
+        large lists.
+        
+        '''
+        stale = []
+        
+        with self.lock:
+            self._load()
+            
+            for tldrfile, listname in tldrfiles:
+                try:
+                    key = file_key(tldrfile)
+                except OSError:
+                    continue
+                
+                try:
+                    cached_key, wordlist = self.entries[tldrfile]
+                except KeyError:
+                    cached_key = None
+                
+                if cached_key != key or wordlist.name != listname:
+                    stale.append((tldrfile, listname, key))
+        
+        # Parse outside the lock, as it can take a while.
+        parsed = _parse_many([entry[:2] for entry in stale], workers)
+        wordlists = {}
+        
+        with self.lock:
+            for (tldrfile, listname, key), wordlist in zip(stale, parsed):
+                if wordlist is not None:
+                    self.entries[tldrfile] = (key, wordlist)
+                    self.changed = True
+            
+            for tldrfile, listname in tldrfiles:
+                try:
+                    wordlist = self.entries[tldrfile][1]
+                except KeyError:
+                    continue
+                
+                # The words are shared with the cache, but the table isn't,
+                # so words can be added to and removed from the copy.
+                wordlists[listname] = WordList(wordlist.name, wordlist.source,
+                                               wordlist.date_edited,
+                                               wordlist.words.copy())
+        
+        return wordlists
+    
+    def prune(self, path, tldrfiles):
+        '''Forget the cached files in a directory which aren't in a list of
+        the files that are there now.
+        
+        Arguments:
+        path -- The directory the files were found in.
+        tldrfiles -- The tldr files which are in the directory.
+        
+        '''
+        tldrfiles = set(tldrfiles)
+        
+        with self.lock:
+            for tldrfile in self.entries.keys():
+                if (os.path.dirname(tldrfile) == os.path.dirname(path) and
+                    tldrfile not in tldrfiles):
+                    del self.entries[tldrfile]
+                    self.changed = True
+    
+    def save(self):
+        '''Write the cache to its snapshot file, if it has one and has
+        changed. The snapshot is written to a temporary file which then
+        replaces the old snapshot, so a partly written snapshot is never
+        read.'''
+        with self.lock:
+            if not self.snapshot or not self.changed:
+                return
+            
+            parts = [self.MAGIC]
+            
+            for tldrfile, (key, wordlist) in self.entries.iteritems():
+                parts.append(self.ENTRY.pack(*(key + (len(tldrfile),))))
+                parts.append(tldrfile)
+                parts.append(codec.encode_wordlist(wordlist))
+            
+            temp = self.snapshot + '.tmp'
+            
+            try:
+                with open(temp, 'wb') as f:
+                    f.write(''.join(parts))
+                
+                os.rename(temp, self.snapshot)
+                self.changed = False
+            except (IOError, OSError):
+                # The cache still works without its snapshot.
+                pass
+    
+    def _load(self):
+        '''Read the snapshot file the first time the cache is used. A
+        missing, old or damaged snapshot is ignored and the files are parsed
+        again.'''
+        if self.loaded:
+            return
+        
+        self.loaded = True
+        
+        if not self.snapshot:
+            return
+        
+        try:
+            with open(self.snapshot, 'rb') as f:
+                data = f.read()
+        except IOError:
+            return
+        
+        if not data.startswith(self.MAGIC):
+            return
+        
+        entries = {}
+        offset = len(self.MAGIC)
+        
+        try:
+            while offset < len(data):
+                entry = self.ENTRY.unpack_from(data, offset)
+                key, length = entry[:-1], entry[-1]
+                offset += self.ENTRY.size
+                tldrfile = data[offset:offset + length]
+                wordlist, offset = codec.decode_wordlist(data, offset + length,
+                                                         compact=True)
+                entries[tldrfile] = (key, wordlist)
+        except (ValueError, struct.error):
+            return
+        
+        self.entries = entries
+
+def file_key(tldrfile):
+    '''Return the modification time, size and inode of a tldr file, which
+    change whenever the file is written or replaced, followed by the
+    modification time and size of its change log.'''
+    stat = os.stat(tldrfile)
+    
+    try:
+        log = os.stat(_log_path(tldrfile))
+        log_key = (log.st_mtime, log.st_size)
+    except OSError:
+        log_key = (0.0, 0)
+    
+    return (stat.st_mtime, stat.st_size, stat.st_ino) + log_key
+
+# The cache of parsed files shared by the whole process.
+cache = TLDRCache(os.environ.get('SPELLATHON_TLDR_SNAPSHOT'))
+
+def _parse_many(tldrfiles, workers=1):
+    '''Parse a list of (tldrfile, listname) tuples, in parallel if more than
+    one worker is asked for.
+    
+    Returns:
+    A list of the WordLists, in the same order, with None for each file which
+    couldn't be read.
+    
+    '''
+    if workers == 0:
+        workers = multiprocessing.cpu_count()
+    
+    if workers <= 1 or len(tldrfiles) <= 1:
+        return [_parse_or_none(tldrfile, listname)
+                for tldrfile, listname in tldrfiles]
+    
+    workers = min(workers, len(tldrfiles))
+    
+    # The workers send back each list in the binary format of tools.codec,
+    # which is far quicker to decode than a pickle of the Words.
+    if ProcessPoolExecutor:
+        with ProcessPoolExecutor(workers) as pool:
+            records = list(pool.map(_parse_encoded, tldrfiles))
+    else:
+        pool = multiprocessing.Pool(workers)
+        
+        try:
+            records = pool.map(_parse_encoded, tldrfiles)
+        finally:
+            pool.close()
+            pool.join()
+    
+    return [record and codec.decode_wordlist(record, compact=True)[0]
+            for record in records]
+
+def _parse_or_none(tldrfile, listname):
+    '''Parse a tldr file into a compact WordList, returning None if it can't
+    be read.'''
+    try:
+        return parse_tldr(tldrfile, listname, compact=True)
+    except IOError:
+        # The file was removed after the directory was listed.
+        return None
+
+def _parse_encoded(args):
+    '''Parse a tldr file in a worker process.
+    
+    Arguments:
+    args -- A (tldrfile, listname) tuple.
+    
+    Returns:
+    The WordList encoded by tools.codec, or None if the file can't be read.
+    
+    '''
+    wordlist = _parse_or_none(*args)
+    return wordlist and codec.encode_wordlist(wordlist)
+
+def load_tldr(tldrfile, listname = 'default'):
+    '''Parse a tldr file to be edited. The file is only read if it has changed
+    since it was last parsed, otherwise its words come from the cache.
+    
+    Arguments:
+    tldrfile -- The tldr file to read from
+    listname -- The name of the word list
+    
+    Returns:
+    A WordList whose words are kept in a SortedWords, as parse_tldr returns.
+    
+    '''
+    wordlist = cache.parse(tldrfile, listname)
+    cache.save()
+    
+    wordlist.words = SortedWords(wordlist.words)
+    return wordlist
+
+def parse_tldr_files(path, workers=None):
+    '''Parse all tldr files in a given path. Only files which have changed
+    since they were last parsed are read.
+    
+    Arguments:
+    path -- The path in which to look for tldr files.
+    workers -- The number of processes to parse with, or 0 for one per CPU.
+    Defaults to WORKERS.
+    
     Returns:
     Dictionary containing each wordlist where the keys are the names of the
     lists.
     
     '''
-    tldrs = {}
+    if workers is None:
+        workers = WORKERS
+    
+    tldrfiles = glob.glob(path + '*.tldr')
     
     # Get each tldr file in the directory and parse it into the dict of tldr
     # files to be returned.
-    for t in glob.glob(path + '*.tldr'):
-        name = t.split(os.sep)[-1].split('.')[0]
-        tldrs[name] = parse_tldr(t, name)
+    tldrs = cache.parse_all([(t, list_name(t)) for t in tldrfiles], workers)
+    
+    cache.prune(path, tldrfiles)
+    cache.save()
 
     return tldrs
 
 def generate_tldr(wordlist, tldrfile):
-    '''Generates a TLDR file given a WordList.
+    '''Generates a TLDR file given a WordList. The file is replaced in one
+    step, so it is never left partly written, and its change log is removed.
     
     Arguments:
     wordlist -- The wordlist to place in the file
     tldrfile -- The file to place the wordlist in
     
     '''
+    return _write_tldr(wordlist, tldrfile, str(datetime.datetime.now()))
+
+def save_tldr(wordlist, tldrfile, changes=None):
+    '''Save a WordList which was read from a tldr file and then edited. If
+    only a few of its words were changed, the changes are appended to the
+    file's change log. Otherwise the whole file is written again.
+    
+    Arguments:
+    wordlist -- The edited wordlist.
+    tldrfile -- The file the wordlist was read from.
+    changes -- A dictionary of the words changed since the wordlist was read
+    or last saved, where each key is a word and each value is its new Word, or
+    None if it was removed. If None, the whole file is written.
+    
+    Returns:
+    True if the wordlist was saved.
+    
+    '''
+    if (changes is None or not os.path.exists(tldrfile) or
+        len(changes) > APPEND_RATIO * max(len(wordlist.words), 1)):
+        return generate_tldr(wordlist, tldrfile)
+    
+    if not changes:
+        return True
+    
+    return _append_log(wordlist, tldrfile, changes)
+
+def _write_tldr(wordlist, tldrfile, date_edited):
+    '''Write a WordList to a temporary file and rename it over a tldr file,
+    then remove the tldr file's change log.'''
+    temp = tldrfile + '.tmp'
+    
+    with write_lock:
+        if not _write_temp(wordlist, temp, date_edited):
+            return False
+        
+        _replace(temp, tldrfile)
+        _remove_log(tldrfile)
+    
+    return True
+
+def _write_temp(wordlist, temp, date_edited):
+    '''Write a WordList to a temporary file in the tldr format, and make sure
+    it is on disk. Returns False if the file can't be written.'''
     try:
-        f = open(tldrfile, 'w')
+        f = open(temp, 'w')
     except IOError:
         return False    
     
-    # Write the metadata to the first three lines of the file.
-    f.write('#' + wordlist.source + '\n')
-    f.write('#' + str(datetime.datetime.now()) + '\n')
-    f.write('#' + str(len(wordlist.words)) + '\n')
-    
-    keys = []
-    
-    # Sort the keys so that we can access the wordlist in proper alphabetical
-    # order. That is, ignoring capitalisation.
-    for string in sorted(wordlist.words.iterkeys(), key=str.lower):
-        keys.append(string)
-    
-    # Write each word to the file. If the word doesn't end in a new line char,
-    # add it to the end so that there is guaranteed to be at most one word
-    # per line.
-    for k in keys:
-        newword = wordlist.words[k].serialise()
-        if newword[-1] != '\n':
-            newword += '\n'
-        f.write(newword)
+    with f:
+        # Write the metadata to the first three lines of the file.
+        f.write('#' + wordlist.source + '\n')
+        f.write('#' + date_edited + '\n')
+        f.write('#' + str(len(wordlist.words)) + '\n')
+        
+        # Write each word to the file, sorted so that we can access the
+        # wordlist in proper alphabetical order. That is, ignoring
+        # capitalisation. A SortedWords is in that order already.
+        if isinstance(wordlist.words, SortedWords):
+            keys = wordlist.words
+        else:
+            keys = sorted(wordlist.words.iterkeys(), key=str.lower)
+        
+        for k in keys:
+            f.write(_serialise_line(wordlist.words[k]))
+        
+        # Make sure the new list is on disk before it replaces the old one.
+        f.flush()
+        os.fsync(f.fileno())
+    
+    return True
+
+def _serialise_line(word):
+    '''Return a word in the tldr format. If the word doesn't end in a new line
+    char, add it to the end so that there is guaranteed to be at most one word
+    per line.'''
+    line = word.serialise()
+    
+    if line[-1] != '\n':
+        line += '\n'
+    
+    return line
+
+def _replace(source, destination):
+    '''Rename a file over another, and make sure the rename is on disk.'''
+    try:
+        os.rename(source, destination)
+    except OSError:
+        # Windows won't rename over an existing file.
+        os.remove(destination)
+        os.rename(source, destination)
+    
+    if hasattr(os, 'O_DIRECTORY'):
+        fd = os.open(os.path.dirname(destination) or '.', os.O_RDONLY |
+                     os.O_DIRECTORY)
+        
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+'''A change log starts with a line holding the date edited of the tldr file it
+was started for, so that a log left behind when the file was replaced is
+ignored. It is followed by batches of changes, each of which is a line for
+every word added or changed ('+' followed by the word in the tldr format) or
+removed ('-' followed by the word), then a line holding the date of the batch
+and the number of words in the list after it ('@' followed by the date, '|'
+and the count). A batch without its last line was cut short and is ignored.
+'''
+def _log_path(tldrfile):
+    '''Return the path of the change log of a tldr file.'''
+    return tldrfile + '.log'
+
+def _remove_log(tldrfile):
+    '''Remove the change log of a tldr file, once every change in it has been
+    written to the file.'''
+    try:
+        os.remove(_log_path(tldrfile))
+    except OSError:
+        pass
+
+def read_log(tldrfile, date_edited):
+    '''Read the change log of a tldr file.
+    
+    Arguments:
+    tldrfile -- The tldr file whose log to read.
+    date_edited -- The date edited in the header of the tldr file.
+    
+    Returns:
+    None if there is no log for this version of the file. Otherwise a tuple of
+    the date the list was last edited, the number of words in it, a
+    dictionary of the words changed by the log, where each value is the new
+    Word or None if the word was removed, and the offset of the end of the
+    last complete batch.
+    
+    '''
+    try:
+        f = open(_log_path(tldrfile), 'r', BUFFER_SIZE)
+    except IOError:
+        return None
+    
+    with f:
+        line = f.readline()
+        
+        if line[1:].strip() != date_edited:
+            return None
+        
+        changes = {}
+        batch = {}
+        count = None
+        offset = end = len(line)
+        
+        for line in iter(f.readline, ''):
+            if not line.endswith('\n'):
+                # The last write was cut short.
+                break
+            
+            offset += len(line)
+            
+            if line[0] == '+':
+                word = Word.deserialise(line[1:])
+                batch[word.word] = word
+            elif line[0] == '-':
+                batch[line[1:-1]] = None
+            elif line[0] == '@':
+                try:
+                    date_edited, count = line[1:-1].rsplit('|', 1)
+                    count = int(count)
+                except ValueError:
+                    break
                 
-    f.close()
+                changes.update(batch)
+                batch = {}
+                end = offset
+    
+    if count is None:
+        return None
+    
+    return date_edited, count, changes, end
+
+def _append_log(wordlist, tldrfile, changes):
+    '''Append a batch of changes to the change log of a tldr file, and merge
+    the log into the file in the background if it has grown too big.'''
+    logfile = _log_path(tldrfile)
+    lines = []
+    
+    with write_lock:
+        words = iter_tldr_file(tldrfile)
+        date_edited = next(words)['date_edited']
+        words.close()
+        
+        # Start a new log if there isn't one for this version of the file.
+        log = read_log(tldrfile, date_edited)
+        
+        if log is None:
+            lines.append('#' + date_edited + '\n')
+        
+        for string, word in sorted(changes.iteritems()):
+            if word is None:
+                lines.append('-' + string + '\n')
+            else:
+                lines.append('+' + _serialise_line(word))
+        
+        lines.append('@%s|%d\n' % (datetime.datetime.now(), len(wordlist.words)))
+        
+        try:
+            if log is None:
+                f = open(logfile, 'w')
+            else:
+                # Drop anything after the last complete batch, which was left
+                # by a write that was cut short.
+                f = open(logfile, 'r+')
+                f.truncate(log[3])
+                f.seek(log[3])
+            
+            with f:
+                f.write(''.join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+        except IOError:
+            return False
+        
+        if os.path.getsize(logfile) > LOG_LIMIT and tldrfile not in compacting:
+            compacting.add(tldrfile)
+            thread = threading.Thread(target=_compact, args=(tldrfile,))
+            thread.daemon = True
+            thread.start()
     
     return True
 
+def _compact(tldrfile):
+    '''Merge the change log of a tldr file into the file. The list is read
+    and written out without holding write_lock, so that saves made meanwhile
+    aren't held up. The new file only replaces the list if neither the list
+    nor its log changed while it was being written, otherwise the log is left
+    to be merged after a later save.'''
+    temp = tldrfile + '.compact'
+    
+    try:
+        key = file_key(tldrfile)
+        wordlist = parse_tldr(tldrfile)
+        
+        if _write_temp(wordlist, temp, wordlist.date_edited):
+            with write_lock:
+                if file_key(tldrfile) == key:
+                    _replace(temp, tldrfile)
+                    _remove_log(tldrfile)
+    except (IOError, OSError):
+        # The list was removed, or can't be written. The log is still applied
+        # whenever the list is read.
+        pass
+    finally:
+        compacting.discard(tldrfile)
+        
+        # Left behind if the list changed or couldn't be replaced.
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+
+def import_tldr(tldrfile, listname):
+    '''Read a tldr file into the database, replacing any list of the same
+    name there.
+    
+    Arguments:
+    tldrfile -- The tldr file to read from
+    listname -- The name to give the list in the database
+    
+    '''
+    lm = database.get_list_manager()
+    
+    try:
+        lm.save_list(parse_tldr(tldrfile, listname))
+        lm.commit()
+    except:
+        lm.discard()
+        raise
+
+def import_tldr_files(path):
+    '''Read all tldr files in a given path into the database, replacing any
+    lists of the same names there. The files are parsed by parse_tldr_files,
+    so they are spread across WORKERS processes.
+    
+    Arguments:
+    path -- The path in which to look for tldr files.
+    
+    Returns:
+    The names of the lists imported.
+    
+    '''
+    wordlists = parse_tldr_files(path)
+    lm = database.get_list_manager()
+    
+    try:
+        for wordlist in wordlists.itervalues():
+            lm.save_list(wordlist)
+        
+        lm.commit()
+    except:
+        lm.discard()
+        raise
+    
+    return sorted(wordlists)
+
+def export_tldr(listname, tldrfile):
+    '''Write a list in the database to a tldr file.
+    
+    Arguments:
+    listname -- The name of the list in the database
+    tldrfile -- The file to place the list in
+    
+    Returns:
+    False if there is no list of that name or the file can't be written,
+    otherwise True.
+    
+    '''
+    wordlist = database.get_list_manager().retrieve_list(listname)
+    
+    if wordlist is None:
+        return False
+    
+    return generate_tldr(wordlist, tldrfile)
+
 def generate_empty_tldr(path, name, author):
     '''Generate an empty tldr file.
     
@@ -0,0 +1,247 @@
+'''
+Module to watch a directory of tldr files for lists being added, changed or
+removed, whether by Spellathon or by anything else, such as a colleague copying
+lists onto a shared drive.
+
+On Linux the directory is watched with inotify, so changes are noticed as soon
+as they are made. Elsewhere, or if inotify can't be used, the modification
+time, size and inode of each file (and the size of its change log) are
+compared every time the watcher is polled. As inotify doesn't see changes made
+by other machines to a network drive, the inotify watcher also rescans the
+directory every RESCAN_INTERVAL seconds.
+
+Exported classes:
+
+ListWatcher -- Reports the tldr files added to, changed in and removed from a
+directory.
+
+'''
+import ctypes
+import ctypes.util
+import errno
+import glob
+import os
+import struct
+import time
+import tools.tldr as tldr
+
+# The events reported by ListWatcher.poll.
+ADDED = 'added'
+CHANGED = 'changed'
+REMOVED = 'removed'
+
+# Seconds between full rescans of a directory watched by inotify.
+RESCAN_INTERVAL = 10.0
+
+# Flags and event masks from <sys/inotify.h>.
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+
+# A list is reported once it has been written and closed, or moved in or out
+# of the directory, so that half written files aren't read.
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE |
+              IN_DELETE_SELF | IN_MOVE_SELF)
+
+# The fixed part of struct inotify_event: wd, mask, cookie and the length of
+# the name which follows it.
+EVENT = struct.Struct('iIII')
+
+def _load_inotify():
+    '''Return the C library if it provides inotify, otherwise None.'''
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError, TypeError):
+        return None
+
+    return libc
+
+libc = _load_inotify()
+
+class ListWatcher(object):
+    '''Reports the tldr files added to, changed in and removed from a
+    directory since it was last polled.
+
+    Public functions:
+    poll -- Return the changes since the last poll.
+    close -- Stop watching the directory.
+
+    '''
+    def __init__(self, path, use_inotify=True):
+        '''Start watching a directory. The files already in it aren't
+        reported.
+
+        Arguments:
+        path -- The directory to watch, ending with a separator, as given to
+        tools.tldr.parse_tldr_files.
+        use_inotify -- If False, always compare the files in the directory
+        instead of using inotify.
+
+        '''
+        self.path = path
+        self.use_inotify = use_inotify and libc is not None
+        self.fd = None
+        self.last_scan = 0
+
+        if self.use_inotify:
+            self._start_inotify()
+
+        # Watch before the first scan, so that nothing changed in between is
+        # missed.
+        self.files = self._scan()
+
+    def poll(self):
+        '''Return the changes to the directory since the last poll.
+
+        Returns:
+        A list of (event, name, path) tuples, where event is ADDED, CHANGED or
+        REMOVED, name is the name of the list and path is the path of its
+        tldr file.
+
+        '''
+        if self.fd is None and self.use_inotify:
+            # The directory may have been created since it was last watched.
+            # Anything written to it before the watch started has to be found
+            # by a scan.
+            self._start_inotify()
+            self.last_scan = 0
+
+        if self.fd is None or time.time() - self.last_scan > RESCAN_INTERVAL:
+            # Drain any inotify events, as the scan covers them.
+            if self.fd is not None:
+                self._read_inotify()
+
+            return self._compare(self._scan())
+
+        touched = self._read_inotify()
+
+        if touched is None:
+            # The events overflowed or the directory went away, so the
+            # directory has to be compared in full.
+            return self._compare(self._scan())
+
+        files = dict(self.files)
+
+        for path in touched:
+            try:
+                files[path] = tldr.file_key(path)
+            except OSError:
+                files.pop(path, None)
+
+        return self._compare(files)
+
+    def close(self):
+        '''Stop watching the directory.'''
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _scan(self):
+        '''Return the key of each tldr file in the directory.'''
+        self.last_scan = time.time()
+        files = {}
+
+        for path in glob.glob(self.path + '*.tldr'):
+            try:
+                files[path] = tldr.file_key(path)
+            except OSError:
+                # The file was removed after the directory was listed.
+                pass
+
+        return files
+
+    def _compare(self, files):
+        '''Return the events which turn the known files into the given files,
+        and remember the given files.'''
+        events = []
+
+        for path, key in files.iteritems():
+            old = self.files.get(path)
+
+            if old is None:
+                events.append((ADDED, tldr.list_name(path), path))
+            elif old != key:
+                events.append((CHANGED, tldr.list_name(path), path))
+
+        for path in self.files:
+            if path not in files:
+                events.append((REMOVED, tldr.list_name(path), path))
+
+        self.files = files
+
+        return sorted(events, key=lambda event: event[1])
+
+    def _start_inotify(self):
+        '''Watch the directory with inotify, leaving self.fd as None if that
+        isn't possible.'''
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+
+        if fd < 0:
+            return
+
+        directory = self.path or '.'
+
+        if libc.inotify_add_watch(fd, directory, WATCH_MASK) < 0:
+            # Most likely the directory doesn't exist yet, so it is scanned
+            # instead until it does.
+            os.close(fd)
+            return
+
+        self.fd = fd
+
+    def _read_inotify(self):
+        '''Read the waiting inotify events.
+
+        Returns:
+        A set of the paths of the tldr files the events were about, or None if
+        the whole directory needs to be scanned.
+
+        '''
+        touched = set()
+        rescan = False
+
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+
+            offset = 0
+
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size
+                name = data[offset:offset + length].rstrip('\0')
+                offset += length
+
+                if mask & (IN_Q_OVERFLOW | IN_IGNORED | IN_DELETE_SELF |
+                           IN_MOVE_SELF):
+                    rescan = True
+                elif name.startswith('.'):
+                    # Hidden files are skipped, as they are by glob.
+                    pass
+                elif name.endswith('.tldr'):
+                    touched.add(self.path + name)
+                elif name.endswith('.tldr.log'):
+                    # A list's change log is part of the list.
+                    touched.add(self.path + name[:-len('.log')])
+
+        if rescan:
+            # The directory itself may have gone, so start watching again
+            # from scratch, or fall back to scanning if it can't be watched.
+            self.close()
+            self._start_inotify()
+            return None
+
+        return touched